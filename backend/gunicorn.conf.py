@@ -0,0 +1,6 @@
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # drop the live gauges of a worker that exited, its counters stay in the multiprocess directory
+    multiprocess.mark_process_dead(worker.pid)
@@ -75,6 +75,8 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'bookhub.instrumentation.RequestMetricsMiddleware',
+    'bookhub.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
@@ -83,9 +85,12 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'bookhub.activity.LastActiveMiddleware',
 
     'django.contrib.messages.middleware.MessageMiddleware',
     'csp.middleware.CSPMiddleware',
+    'bookhub.replica.ReplicaMiddleware',
+    'bookhub.profiling.ProfilingMiddleware',
 
 ]
 X_FRAME_OPTIONS = "SAMEORIGIN"
@@ -115,11 +120,35 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'backend.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # keep connections open between requests instead of reconnecting every time
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Optional read replica for heavy read endpoints, a second SQLite file refreshed by `manage.py snapshot_replica`
+if os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / os.environ['DB_REPLICA_NAME'],
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['bookhub.replica.ReplicaRouter']
+# how long a client that just wrote keeps reading from default
+REPLICA_PIN_SECONDS = 30
+
+# applied to every new SQLite connection by backend/sqlite3/base.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 268435456,
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -158,18 +187,49 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# uploads are streamed to disk and hashed on the way in, see bookhub/uploads.py
+FILE_UPLOAD_HANDLERS = ['bookhub.uploads.HashingFileUploadHandler']
+# books/<id>/file/ hands the transfer to the web server when set: 'x-accel-redirect' (nginx) or 'x-sendfile'
+BOOK_FILE_SENDFILE = os.environ.get('BOOK_FILE_SENDFILE') or None
+# nginx `internal` location aliased to MEDIA_ROOT
+BOOK_FILE_ACCEL_PREFIX = '/protected-media/'
+BOOK_FILE_CACHE_SECONDS = 3600
+# cover thumbnail widths rendered in the background and exposed as pictureSrcset
+BOOK_COVER_WIDTHS = (160, 320, 640)
+
+# database backed job queue, processed by `manage.py run_worker`
+JOB_QUEUE_POLL_SECONDS = 1
+JOB_QUEUE_MAX_ATTEMPTS = 5
+JOB_QUEUE_RETRY_BASE_SECONDS = 10
+# running jobs locked for longer than this are considered abandoned and queued again
+JOB_QUEUE_LOCK_TIMEOUT = 600
+# how often each worker thread looks for those
+JOB_QUEUE_REQUEUE_SECONDS = 60
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+# discovers the tests from BASE_DIR, see backend/test_runner.py
+TEST_RUNNER = 'backend.test_runner.ProjectDiscoverRunner'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         # "rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'bookhub.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_PAGINATION_CLASS': 'bookhub.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+    # orjson when installed, the stdlib json module otherwise (bookhub/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'bookhub.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
+# upper bound for the ?page_size= query parameter on list endpoints
+MAX_PAGE_SIZE = 100
+# JSON responses from this size on are sent brotli or gzip compressed (bookhub/compression.py)
+RESPONSE_COMPRESSION_MIN_BYTES = 1024
 
 ACCOUNT_USERNAME_REQUIRED = False
 ACCOUNT_AUTHENTICATION_METHOD = 'email'
@@ -183,8 +243,60 @@ SIMPLE_JWT = {
     'SIGNING_KEY': "123qweaszxc",
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
+    # tokens carry a hash of the password they were issued for: changing it revokes them, and the auth
+    # user cache is keyed by it (bookhub/authentication.py)
+    "CHECK_REVOKE_TOKEN": True,
 }
 
+# users resolved from access tokens are cached this long (bookhub/authentication.py). With the default
+# per-process cache other workers see a user change only when their entry expires.
+AUTH_USER_CACHE = 'default'
+AUTH_USER_CACHE_SECONDS = 60
+
+# reading-time heartbeats are buffered per worker and written out every N seconds
+READING_TIME_FLUSH_INTERVAL = 5
+READING_HEARTBEAT_MAX_SECONDS = 300
+
+# User.last_active is written at most once per user and window, in one batch per interval
+LAST_ACTIVE_WINDOW = 300
+LAST_ACTIVE_FLUSH_INTERVAL = 60
+
+# recommend() trains on readers with this many interactions who were active (last_active) within
+# RECOMMEND_ACTIVE_DAYS (never seen, NULL, counts as active), None to ignore activity; everyone else, and
+# everyone while fewer than two readers qualify, gets the popularity ranking
+RECOMMEND_ACTIVE_DAYS = 90
+RECOMMEND_MIN_INTERACTIONS = 1
+
+# in-process typeahead index; other workers' changes show up after a full rebuild
+AUTOCOMPLETE_REFRESH_SECONDS = 300
+AUTOCOMPLETE_MAX_RESULTS = 10
+
+# per-request metrics (bookhub/instrumentation.py)
+# Server-Timing with query counts and timings for everyone; staff get it regardless
+REQUEST_METRICS_HEADER = DEBUG
+REQUEST_SLOW_MS = 500
+REQUEST_QUERY_BUDGET = 30
+# share of slow / over budget requests logged with their SQL
+REQUEST_SLOW_SAMPLE_RATE = 1.0
+
+# /metrics asks for this bearer token when set, without it only localhost and staff get it (bookhub/metrics.py)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# staff requests with `X-Profile: 1` / `?_profile=memory` are profiled here (bookhub/profiling.py)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_KEEP = 50
+PROFILE_ALLOCATIONS_TOP = 25
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'bookhub': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
 
 CSP_DEFAULT_SRC = ("'self'",)
 CSP_SCRIPT_SRC = ("'self'", "'unsafe-inline'", "'unsafe-eval'")
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    sqlite3 backend for several gunicorn workers sharing one database file:
+    applies SQLITE_PRAGMAS (WAL, busy timeout, ...) on every new connection and opens
+    transactions with BEGIN IMMEDIATE, so writers queue on the busy timeout instead of
+    failing with "database is locked" when a read lock can't be upgraded.
+
+    The catch is that every atomic block takes the write lock, read-only ones included, so
+    it waits behind (and blocks) writers. The app only opens atomic blocks to write, and
+    autocommit reads are unaffected. bench_sqlite_writes runs read-only transactions next
+    to the writers to measure it.
+    """
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE")
@@ -0,0 +1,30 @@
+import logging
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class ProjectDiscoverRunner(DiscoverRunner):
+    """
+    The repository root has an __init__.py, so unittest discovery would import the apps as `package.<app>`
+    and fail on the models. Discovery starts at BASE_DIR instead.
+
+    The per-request log lines of RequestMetricsMiddleware are muted for the run, tests can still assertLogs them.
+    """
+    quiet_loggers = ('bookhub.requests',)
+
+    def __init__(self, top_level=None, **kwargs):
+        super().__init__(top_level=top_level or str(settings.BASE_DIR), **kwargs)
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._logger_levels = {}
+        for name in self.quiet_loggers:
+            logger = logging.getLogger(name)
+            self._logger_levels[name] = logger.level
+            logger.setLevel(logging.CRITICAL)
+
+    def teardown_test_environment(self, **kwargs):
+        for name, level in self._logger_levels.items():
+            logging.getLogger(name).setLevel(level)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,107 @@
+import atexit
+import datetime
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .models import User
+
+# users per UPDATE statement, bulk_update binds two parameters per user
+FLUSH_CHUNK_SIZE = 200
+
+
+class ActivityTracker:
+    """
+    Records the last request time per user in memory and writes User.last_active with one bulk_update
+    every LAST_ACTIVE_FLUSH_INTERVAL seconds. A user is queued at most once per LAST_ACTIVE_WINDOW,
+    so last_active is precise to that window and costs at most one write per user and window (per worker).
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._pending = {}
+        # user id -> last time queued, for the per-window throttle
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def touch(self, user_id, now=None):
+        now = now or timezone.now()
+        window = datetime.timedelta(seconds=settings.LAST_ACTIVE_WINDOW)
+        with self._lock:
+            seen = self._seen.get(user_id)
+            if seen is not None and now - seen < window:
+                return False
+            self._seen[user_id] = now
+            self._pending[user_id] = now
+            self._schedule()
+        return True
+
+    def _schedule(self):
+        # called with the lock held
+        if self._timer is None:
+            interval = self.interval or settings.LAST_ACTIVE_FLUSH_INTERVAL
+            self._timer = threading.Timer(interval, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        window = datetime.timedelta(seconds=settings.LAST_ACTIVE_WINDOW)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            # users outside the window would be queued again anyway
+            cutoff = timezone.now() - window
+            self._seen = {user_id: seen for user_id, seen in self._seen.items() if seen >= cutoff}
+        if not pending:
+            return 0
+
+        try:
+            User.objects.bulk_update(
+                [User(id=user_id, last_active=last_active) for user_id, last_active in pending.items()],
+                ['last_active'], batch_size=FLUSH_CHUNK_SIZE,
+            )
+        except Exception:
+            # requeue, unless a newer request already did
+            with self._lock:
+                for user_id, last_active in pending.items():
+                    self._pending.setdefault(user_id, last_active)
+                self._schedule()
+            raise
+        return len(pending)
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # the timer thread owns its own connection, don't leak it
+            connections.close_all()
+
+
+activity_tracker = ActivityTracker()
+atexit.register(activity_tracker.flush)
+
+
+class LastActiveMiddleware:
+    """
+    Marks the requesting user active. Runs after the response so it also sees users the API view
+    authenticated with a JWT (DRF sets them on the Django request).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            activity_tracker.touch(user.id)
+        return response
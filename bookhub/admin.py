@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BookRating, Genre, Book, User
+from .models import BookRating, Genre, Book, User, Job
 
 # Register your models here.
 
@@ -8,3 +8,4 @@ admin.site.register(BookRating)
 admin.site.register(User)
 admin.site.register(Genre)
 admin.site.register(Book)
+admin.site.register(Job)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate, pre_migrate
 
 
 class BookhubConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bookhub'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import drop_fts_triggers, ensure_fts_index
+
+        pre_migrate.connect(drop_fts_triggers, sender=self)
+        post_migrate.connect(ensure_fts_index, sender=self)
@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .metrics import cache_lookup
+from .models import User
+from .replica import read_from_default
+
+
+def password_version(password):
+    # what the revoke claim of tokens issued for this password holds
+    return get_md5_hash_password(password) if api_settings.CHECK_REVOKE_TOKEN else ''
+
+
+def token_version(validated_token):
+    return validated_token.get(api_settings.REVOKE_TOKEN_CLAIM, '') if api_settings.CHECK_REVOKE_TOKEN else ''
+
+
+def user_cache_key(user_id, version):
+    # keyed by the password version too: tokens issued after a password change never read a user cached
+    # under the old password, in any worker
+    return f'auth-user:{user_id}:{version}'
+
+
+def invalidate_user(user_id, *passwords):
+    caches[settings.AUTH_USER_CACHE].delete_many(
+        [user_cache_key(user_id, password_version(password)) for password in passwords]
+    )
+
+
+def token_user(user_id):
+    # a User carrying only its id: enough for filters and m2m add/remove, every other field is blank
+    user = User(id=user_id, is_active=True)
+    user._state.adding = False
+    user._state.db = 'default'
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps resolved users in the AUTH_USER_CACHE cache for AUTH_USER_CACHE_SECONDS
+    instead of loading the row on every request. Entries are keyed by user and token password version (the
+    CHECK_REVOKE_TOKEN claim); saving or deleting a user drops its entries in this process (signals.py).
+
+    Views with `stateless_user = True` skip the lookup altogether and get a User built from the token's id
+    claim. They trust the token until it expires, so keep that to endpoints that only need request.user.id.
+    """
+
+    def authenticate(self, request):
+        view = request.parser_context.get('view')
+        self.stateless = getattr(view, 'stateless_user', False)
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        if self.stateless:
+            return token_user(user_id)
+
+        cache = caches[settings.AUTH_USER_CACHE]
+        key = user_cache_key(user_id, token_version(validated_token))
+        user = cache.get(key)
+        cache_lookup('auth_user', hit=user is not None)
+        if user is None:
+            # the parent loads the row and rejects missing and inactive users and revoked tokens. Never from the
+            # replica: accounts created or passwords changed since the last snapshot would be rejected
+            with read_from_default():
+                user = super().get_user(validated_token)
+            cache.set(key, user, settings.AUTH_USER_CACHE_SECONDS)
+        elif api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
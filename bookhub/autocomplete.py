@@ -0,0 +1,151 @@
+import bisect
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import cache_lookup
+from .models import Book
+
+# only the first few words of a title are indexed, which bounds the index size per book
+MAX_TITLE_WORDS = 8
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.casefold().split())
+
+
+def author_name(first_name, last_name):
+    return ' '.join(part for part in (first_name, last_name) if part)
+
+
+class PrefixIndex:
+    """
+    In-process typeahead index: a sorted list of (normalized key, book id) pairs searched with bisect.
+    Every word start of the title and of the author name is a key, so "drag" finds "Wings of dragons".
+
+    Saves in this process update it incrementally (see signals.py); changes made by other workers
+    are picked up by a full rebuild every AUTOCOMPLETE_REFRESH_SECONDS. That rebuild runs in a background
+    thread, one at a time, while searches keep reading the current index. Only the very first search
+    waits for a build, and concurrent first searches wait for the same one.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._books = {}
+        self._by_author = {}
+        self._built_at = None
+        self._lock = threading.Lock()
+        # held for the duration of a full rebuild
+        self._rebuild_lock = threading.Lock()
+
+    @property
+    def built(self):
+        return self._built_at is not None
+
+    def rebuild(self):
+        rows = Book.objects.values_list('id', 'title', 'author_id', 'author__first_name', 'author__last_name')
+        keys, books, by_author = [], {}, {}
+        for book_id, title, author_id, first_name, last_name in rows.iterator():
+            entry = (book_id, title, author_name(first_name, last_name))
+            books[book_id] = (entry, author_id)
+            by_author.setdefault(author_id, set()).add(book_id)
+            keys.extend((key, book_id) for key in self._keys_for(entry))
+        keys.sort()
+        with self._lock:
+            self._keys, self._books, self._by_author = keys, books, by_author
+            self._built_at = time.monotonic()
+
+    def update_book(self, book_id, title, author_id, author):
+        with self._lock:
+            self._insert((book_id, title, author), author_id)
+
+    def remove_book(self, book_id):
+        with self._lock:
+            self._remove(book_id)
+
+    def update_author(self, author_id, author):
+        with self._lock:
+            for book_id in list(self._by_author.get(author_id, ())):
+                (_, title, _), _ = self._books[book_id]
+                self._insert((book_id, title, author), author_id)
+
+    def search(self, query, limit):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        stale = not self.built or time.monotonic() - self._built_at > settings.AUTOCOMPLETE_REFRESH_SECONDS
+        cache_lookup('autocomplete', hit=not stale)
+        if not self.built:
+            with self._rebuild_lock:
+                if not self.built:
+                    self.rebuild()
+        elif stale:
+            self._rebuild_in_background()
+
+        results, seen = [], set()
+        with self._lock:
+            position = bisect.bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and len(results) < limit:
+                key, book_id = self._keys[position]
+                if not key.startswith(prefix):
+                    break
+                if book_id not in seen:
+                    seen.add(book_id)
+                    results.append(self._books[book_id][0])
+                position += 1
+        return results
+
+    def _rebuild_in_background(self):
+        if not self._rebuild_lock.acquire(blocking=False):
+            return  # already rebuilding
+        try:
+            threading.Thread(target=self._rebuild_from_thread, daemon=True).start()
+        except BaseException:
+            self._rebuild_lock.release()
+            raise
+
+    def _rebuild_from_thread(self):
+        try:
+            self.rebuild()
+        finally:
+            self._rebuild_lock.release()
+            # the rebuild thread owns its own connection, don't leak it
+            connections.close_all()
+
+    def _insert(self, entry, author_id):
+        book_id = entry[0]
+        self._remove(book_id)
+        self._books[book_id] = (entry, author_id)
+        self._by_author.setdefault(author_id, set()).add(book_id)
+        for key in self._keys_for(entry):
+            bisect.insort(self._keys, (key, book_id))
+
+    def _remove(self, book_id):
+        if book_id not in self._books:
+            return
+        entry, author_id = self._books.pop(book_id)
+        self._by_author.get(author_id, set()).discard(book_id)
+        for key in self._keys_for(entry):
+            position = bisect.bisect_left(self._keys, (key, book_id))
+            if position < len(self._keys) and self._keys[position] == (key, book_id):
+                del self._keys[position]
+
+    @staticmethod
+    def _keys_for(entry):
+        _, title, author = entry
+        keys = set()
+        for text, max_words in ((normalize(title), MAX_TITLE_WORDS), (normalize(author), None)):
+            words = text.split(' ')
+            for start in range(len(words[:max_words])):
+                key = ' '.join(words[start:])
+                if key:
+                    keys.add(key)
+        return keys
+
+
+book_prefix_index = PrefixIndex()
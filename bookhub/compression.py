@@ -0,0 +1,97 @@
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .instrumentation import timed
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# levels for compressing per request: most of the size win at a fraction of the maximum levels' CPU cost
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# JSON only: HTML pages (the admin, the browsable API) carry CSRF tokens next to reflected input, and compressing
+# those leaks the token through the compressed size (BREACH)
+COMPRESSIBLE_TYPES = ('application/json',)
+
+
+def _brotli(content):
+    return brotli.compress(content, quality=BROTLI_QUALITY)
+
+
+def _gzip(content):
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+# in order of preference when the client accepts several equally
+ENCODERS = {'br': _brotli, 'gzip': _gzip} if brotli is not None else {'gzip': _gzip}
+
+
+def accepted_encodings(header):
+    # Accept-Encoding as {coding: q}, e.g. "gzip, br;q=0.8" -> {'gzip': 1.0, 'br': 0.8}
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def negotiate(header):
+    accepted = accepted_encodings(header)
+    best, best_q = None, 0.0
+    for coding in ENCODERS:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compresses JSON responses of at least RESPONSE_COMPRESSION_MIN_BYTES with the best encoding
+    the client accepts: brotli when the module is installed, gzip otherwise. Streamed responses (book files)
+    are left alone. Smaller responses gain little and would only add CPU time.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+        if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        with timed('compress'):
+            compressed = ENCODERS[coding](response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        # the bytes differ from the uncompressed representation, so a strong ETag becomes weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
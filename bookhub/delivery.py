@@ -0,0 +1,128 @@
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from .uploads import blob_sha256
+
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+
+class FileRange:
+    """
+    Read-only view of `length` bytes of an open file starting at `start`.
+    Keeps fileno() so gunicorn can still sendfile() it, bounded by the Content-Length we set.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def file_etag(field_file, stat):
+    sha256 = blob_sha256(field_file.name)
+    if sha256:
+        return f'"{sha256}"'
+    return f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) of a single `bytes=` range, inclusive, None when the header should be ignored
+    (absent, malformed or multi-range) and False when the range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or not (match['start'] or match['end']):
+        return None
+    if not match['start']:
+        # suffix range: the last N bytes
+        length = int(match['end'])
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(match['start'])
+    end = min(int(match['end']), size - 1) if match['end'] else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    modified_since = parse_http_date_safe(if_range)
+    return modified_since is not None and int(last_modified) <= modified_since
+
+
+def serve_book_file(request, field_file, content_type='application/pdf'):
+    """
+    Serve a stored file with ETag / conditional request / Range support.
+    With BOOK_FILE_SENDFILE set the body is left to the front web server (nginx X-Accel-Redirect
+    or Apache X-Sendfile), otherwise a FileResponse streams it through the wsgi file wrapper.
+    """
+    path = field_file.path
+    stat = os.stat(path)
+    etag = file_etag(field_file, stat)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        return not_modified
+
+    backend = settings.BOOK_FILE_SENDFILE
+    if backend == 'x-accel-redirect':
+        # nginx answers Range requests on its own
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.BOOK_FILE_ACCEL_PREFIX + field_file.name
+    elif backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    else:
+        response = _file_response(request, path, stat.st_size, etag, stat.st_mtime, content_type)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, public=True, max_age=settings.BOOK_FILE_CACHE_SECONDS)
+    return response
+
+
+def _file_response(request, path, size, etag, last_modified, content_type):
+    byte_range = None
+    if if_range_matches(request, etag, last_modified):
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        return FileResponse(file, content_type=content_type)
+
+    start, end = byte_range
+    response = FileResponse(FileRange(file, start, end - start + 1), status=206, content_type=content_type)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
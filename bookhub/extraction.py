@@ -0,0 +1,52 @@
+import hashlib
+import logging
+
+from django.db import transaction
+from pypdf import PdfReader
+from pypdf.errors import PdfReadError
+
+from .jobs import enqueue, task
+from .models import Book
+from .search import replace_book_pages
+from .uploads import blob_sha256
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(field_file):
+    digest = hashlib.sha256()
+    with field_file.open('rb'):
+        for chunk in field_file.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@task
+def extract_book_text(book_id):
+    """
+    Index the text of a book's pdf page by page, unless the file is unchanged since the last extraction.
+    """
+    book = Book.objects.filter(id=book_id).only('id', 'pdfFile', 'pdf_text_sha256').first()
+    if book is None or not book.pdfFile:
+        return False
+
+    sha256 = blob_sha256(book.pdfFile.name) or file_sha256(book.pdfFile)
+    if sha256 == book.pdf_text_sha256:
+        return False
+
+    try:
+        with book.pdfFile.open('rb') as handle:
+            pages = [page.extract_text() or '' for page in PdfReader(handle).pages]
+    except PdfReadError as error:
+        # remember the hash anyway so a broken upload is not parsed again on every save
+        logger.warning('Could not read pdf of book %s: %s', book.id, error)
+        pages = []
+
+    with transaction.atomic():
+        replace_book_pages(book.id, pages)
+        Book.objects.filter(id=book.id).update(pdf_text_sha256=sha256)
+    return True
+
+
+def schedule_text_extraction(book_id):
+    enqueue('extract_book_text', book_id, dedup_key=f'extract_book_text:{book_id}')
@@ -0,0 +1,33 @@
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def _names(params, name):
+    return {field.strip() for value in params.getlist(name) for field in value.split(',') if field.strip()}
+
+
+def requested_fields(request, available):
+    """
+    The names of `available`, in order, that a GET asked for with ?fields=a,b and/or ?omit=c (both comma
+    separated, unknown names ignored). Every field without either, and for any other method: writes
+    always answer with the full representation.
+    """
+    available = list(available)
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return available
+    params = getattr(request, 'query_params', request.GET)
+    only, omit = _names(params, FIELDS_PARAM), _names(params, OMIT_PARAM)
+    return [field for field in available if (not only or field in only) and field not in omit]
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin dropping the fields a GET left out with ?fields= / ?omit= (see requested_fields).
+    Nested serializers are not affected.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = set(requested_fields(self.context.get('request'), self.fields))
+        for name in [name for name in self.fields if name not in keep]:
+            self.fields.pop(name)
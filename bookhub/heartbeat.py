@@ -0,0 +1,130 @@
+import atexit
+import datetime
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connections, transaction
+from django.db.models import Case, DurationField, F, Q, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Book, BookRating, User
+
+logger = logging.getLogger(__name__)
+
+# pairs per UPDATE statement, keeps us well under SQLite's bound-parameter limit
+FLUSH_CHUNK_SIZE = 100
+
+
+class ReadingTimeBuffer:
+    """
+    Accumulates reading-time heartbeats per (user, book) in memory and writes
+    them out periodically as atomic `reading_time + delta` updates.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._pending = defaultdict(datetime.timedelta)
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, user_id, book_id, delta):
+        with self._lock:
+            self._pending[(user_id, book_id)] += delta
+            if self._timer is None:
+                interval = self.interval or settings.READING_TIME_FLUSH_INTERVAL
+                self._timer = threading.Timer(interval, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def pending(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(datetime.timedelta)
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return 0
+
+        items = list(pending.items())
+        requeue, error = [], None
+        for start in range(0, len(items), FLUSH_CHUNK_SIZE):
+            chunk = items[start:start + FLUSH_CHUNK_SIZE]
+            try:
+                with transaction.atomic():
+                    self._write_chunk(chunk)
+            except OperationalError as exc:
+                # locked or unreachable database: the next flush retries everything not written yet
+                requeue, error = items[start:], exc
+                break
+            except DatabaseError:
+                # a pair the database rejects must not hold back the rest of the chunk, or every later flush
+                requeue, error = self._write_separately(chunk)
+                if requeue:
+                    requeue += items[start + FLUSH_CHUNK_SIZE:]
+                    break
+
+        if requeue:
+            # put the deltas back so the next flush retries them
+            for (user_id, book_id), delta in requeue:
+                self.add(user_id, book_id, delta)
+            raise error
+        return len(items)
+
+    def _write_separately(self, chunk):
+        """
+        Write the pairs of a failed chunk one at a time, dropping those that still fail. Returns the pairs
+        left to retry and the error, once the database itself fails.
+        """
+        for position, ((user_id, book_id), delta) in enumerate(chunk):
+            try:
+                with transaction.atomic():
+                    self._write_chunk([((user_id, book_id), delta)])
+            except OperationalError as exc:
+                return chunk[position:], exc
+            except DatabaseError:
+                logger.exception('Dropping %s of reading time of user %s on book %s', delta, user_id, book_id)
+        return [], None
+
+    def _write_chunk(self, items):
+        pairs = Q()
+        whens = []
+        for (user_id, book_id), delta in items:
+            pairs |= Q(user_id=user_id, book_id=book_id)
+            whens.append(When(user_id=user_id, book_id=book_id, then=Value(delta)))
+
+        # heartbeats for books the user never rated yet get a fresh row first;
+        # another worker may create the same row concurrently, the unique pair makes that a no-op.
+        # Books and accounts deleted since the heartbeat (stateless tokens outlive the user) are skipped
+        existing = set(BookRating.objects.filter(pairs).values_list('user_id', 'book_id'))
+        missing = [(user_id, book_id) for (user_id, book_id), _ in items if (user_id, book_id) not in existing]
+        if missing:
+            live_books = set(Book.objects.filter(id__in={pair[1] for pair in missing}).values_list('id', flat=True))
+            live_users = set(User.objects.filter(id__in={pair[0] for pair in missing}).values_list('id', flat=True))
+            BookRating.objects.bulk_create([
+                BookRating(user_id=user_id, book_id=book_id)
+                for user_id, book_id in missing
+                if book_id in live_books and user_id in live_users
+            ], ignore_conflicts=True)
+
+        BookRating.objects.filter(pairs).update(
+            reading_time=Coalesce(F('reading_time'), Value(datetime.timedelta(0))) + Case(
+                *whens, default=Value(datetime.timedelta(0)), output_field=DurationField()
+            )
+        )
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # the timer thread owns its own connection, don't leak it
+            connections.close_all()
+
+
+reading_time_buffer = ReadingTimeBuffer()
+atexit.register(reading_time_buffer.flush)
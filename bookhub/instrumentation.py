@@ -0,0 +1,138 @@
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+
+from .metrics import observe_request
+from .profiling import is_staff
+
+logger = logging.getLogger('bookhub.requests')
+slow_logger = logging.getLogger('bookhub.requests.slow')
+
+# statements kept per request for the slow request log
+MAX_SAMPLED_QUERIES = 200
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Timings of one request. Also the connection.execute_wrapper counting its queries and DB time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.timers = {}
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            if len(self.statements) < MAX_SAMPLED_QUERIES:
+                self.statements.append((round(duration * 1000, 3), sql))
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    def server_timing(self):
+        parts = [f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"']
+        parts += [f'{name};dur={duration * 1000:.1f}' for name, duration in self.timers.items()]
+        parts.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+@contextlib.contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request's `name` timer (no-op outside requests).
+    """
+    metrics = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.timers[name] = metrics.timers.get(name, 0.0) + time.perf_counter() - start
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """
+    Counts `.data` of a serializer into the request's serializer timer; pair it with
+    `list_serializer_class = TimedListSerializer` in Meta for many=True.
+    """
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class RequestMetricsMiddleware:
+    """
+    Records query count, DB time, serializer time and total time of every request,
+    returns them as a Server-Timing header (to staff only unless REQUEST_METRICS_HEADER) and logs
+    them as one JSON line. Requests slower than REQUEST_SLOW_MS or above REQUEST_QUERY_BUDGET
+    queries are sampled to the slow log with their SQL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        request.metrics = metrics
+        token = _current.set(metrics)
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+            metrics.finish()
+
+        # query counts and timings tell an outsider which requests are expensive
+        if settings.REQUEST_METRICS_HEADER or is_staff(request):
+            response['Server-Timing'] = metrics.server_timing()
+        self.log(request, response, metrics)
+        return response
+
+    def log(self, request, response, metrics):
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(metrics.total * 1000, 1),
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'queries': metrics.queries,
+            **{f'{name}_ms': round(duration * 1000, 1) for name, duration in metrics.timers.items()},
+        }
+        logger.info(json.dumps(record))
+        observe_request(record['view'], request.method, response.status_code, metrics.total, metrics.queries)
+
+        slow = record['total_ms'] >= settings.REQUEST_SLOW_MS or metrics.queries > settings.REQUEST_QUERY_BUDGET
+        if slow and random.random() < settings.REQUEST_SLOW_SAMPLE_RATE:
+            slow_logger.warning(json.dumps({**record, 'sql': metrics.statements}))
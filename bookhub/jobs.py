@@ -0,0 +1,148 @@
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(func):
+    """
+    Register a function as a job task under its own name. Arguments must be JSON serializable.
+    """
+    TASKS[func.__name__] = func
+    return func
+
+
+def enqueue(task_name, *args, dedup_key=None, delay=None, max_attempts=None):
+    """
+    Queue a job, returning it, or None when a job with the same dedup_key is already waiting.
+    Call it inside the transaction that made the work necessary: the job only becomes visible on commit.
+    """
+    if task_name not in TASKS:
+        raise ValueError(f'Unknown task {task_name!r}')
+    job = Job(
+        task=task_name,
+        args=list(args),
+        dedup_key=dedup_key,
+        run_at=timezone.now() + (delay or datetime.timedelta(0)),
+        max_attempts=max_attempts or settings.JOB_QUEUE_MAX_ATTEMPTS,
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        return None
+    return job
+
+
+def queue_depth():
+    counts = dict(Job.objects.values_list('status').annotate(Count('id')).order_by())
+    return {status: counts.get(status, 0) for status, _ in Job.STATUS_CHOICES}
+
+
+def claim_job(worker_id):
+    """
+    Lock the next due job for this worker. Uses SELECT ... FOR UPDATE SKIP LOCKED where the database has it;
+    on SQLite, where writers are serialized anyway, a conditional UPDATE on the status is the lock.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'id')
+    claim = dict(status=Job.RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1)
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job_id = due.select_for_update(skip_locked=True).values_list('id', flat=True).first()
+            if job_id is None:
+                return None
+            Job.objects.filter(id=job_id).update(**claim)
+        return Job.objects.get(id=job_id)
+
+    for job_id in due.values_list('id', flat=True)[:10]:
+        if Job.objects.filter(id=job_id, status=Job.QUEUED).update(**claim):
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def retry_delay(attempts):
+    # exponential backoff: base, 2 * base, 4 * base ... capped at an hour
+    return datetime.timedelta(seconds=min(settings.JOB_QUEUE_RETRY_BASE_SECONDS * 2 ** (attempts - 1), 3600))
+
+
+def run_job(job):
+    try:
+        TASKS[job.task](*job.args)
+    except Exception as error:
+        logger.exception('Job %s failed (attempt %s/%s)', job, job.attempts, job.max_attempts)
+        last_error = ''.join(traceback.format_exception(error))[-4000:]
+        if job.task not in TASKS or job.attempts >= job.max_attempts:
+            Job.objects.filter(id=job.id).update(status=Job.FAILED, last_error=last_error)
+            return False
+        try:
+            with transaction.atomic():
+                Job.objects.filter(id=job.id).update(
+                    status=Job.QUEUED, run_at=timezone.now() + retry_delay(job.attempts), last_error=last_error
+                )
+        except IntegrityError:
+            # the same work was queued again meanwhile, that job covers it
+            Job.objects.filter(id=job.id).delete()
+        return False
+
+    Job.objects.filter(id=job.id).delete()
+    return True
+
+
+def requeue_stale_jobs():
+    # jobs of workers that died mid-run go back to the queue
+    stale = timezone.now() - datetime.timedelta(seconds=settings.JOB_QUEUE_LOCK_TIMEOUT)
+    for job_id in Job.objects.filter(status=Job.RUNNING, locked_at__lt=stale).values_list('id', flat=True):
+        try:
+            with transaction.atomic():
+                Job.objects.filter(id=job_id, status=Job.RUNNING).update(status=Job.QUEUED, locked_by='')
+        except IntegrityError:
+            Job.objects.filter(id=job_id).delete()
+
+
+def work(stop, drain=False):
+    """
+    Worker loop for one thread: claim and run jobs until `stop` is set, or until the queue is empty with drain.
+    Database errors (e.g. "database is locked" under write load) are logged and retried with a backoff
+    instead of ending the thread; a job left running by one is requeued after JOB_QUEUE_LOCK_TIMEOUT.
+    """
+    worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+    failures = 0
+    # run_worker requeues once at startup
+    next_requeue = time.monotonic() + settings.JOB_QUEUE_REQUEUE_SECONDS
+    try:
+        while not stop.is_set():
+            try:
+                if time.monotonic() >= next_requeue:
+                    requeue_stale_jobs()
+                    next_requeue = time.monotonic() + settings.JOB_QUEUE_REQUEUE_SECONDS
+                job = claim_job(worker_id)
+                if job is None:
+                    if drain:
+                        return
+                    stop.wait(settings.JOB_QUEUE_POLL_SECONDS)
+                    continue
+                run_job(job)
+                failures = 0
+            except Exception:
+                failures += 1
+                logger.exception('Job worker %s failed (%s in a row)', worker_id, failures)
+                connection.close_if_unusable_or_obsolete()
+                stop.wait(min(settings.JOB_QUEUE_POLL_SECONDS * 2 ** failures, 60))
+    finally:
+        connection.close()
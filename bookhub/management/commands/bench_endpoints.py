@@ -0,0 +1,273 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import time
+
+import django
+import numpy as np
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework_simplejwt.tokens import AccessToken
+
+from bookhub.activity import activity_tracker
+from bookhub.heartbeat import reading_time_buffer
+from bookhub.models import Book, BookRating, User
+from bookhub.replica import REPLICA
+from bookhub.views import training_user_ids
+
+from .seed_scale import SEED_DOMAIN, WORDS
+
+# seed_scale arguments of each dataset
+DATASETS = {
+    'small': {'users': 500, 'books': 200, 'density': 0.02},
+    'medium': {'users': 2000, 'books': 1000, 'density': 0.01},
+    'large': {'users': 20000, 'books': 2000, 'density': 0.005},
+}
+# recommend rebuilds its model on every request, a few runs are enough
+MAX_ITERATIONS = {'recommend': 5}
+WARMUP = 2
+# requests authenticate as one of this many seeded users
+AUTH_USERS = 200
+
+
+@contextlib.contextmanager
+def throwaway_database(directory):
+    """
+    A migrated, empty copy of the default database as a file in `directory`. SQLite's default in-memory
+    test database would survive destroy_test_db (Django never closes it) and skip the WAL setup.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    previous = test_settings.get('NAME')
+    test_settings['NAME'] = os.path.join(directory, 'throwaway.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        # buffered writes belong to this database, not to the one restored afterwards
+        activity_tracker.flush()
+        reading_time_buffer.flush()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = previous
+
+
+class Workload:
+    """
+    Ids and tokens the endpoint requests draw from, loaded once per dataset.
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.client = Client()
+        self.book_ids = list(Book.objects.values_list('id', flat=True))
+        user_ids = list(User.objects.filter(email__endswith=f'@{SEED_DOMAIN}').values_list('id', flat=True))
+        self.user_ids = self.rng.sample(user_ids, min(AUTH_USERS, len(user_ids)))
+        self.ratings = list(BookRating.objects.filter(user_id__in=self.user_ids).values_list('id', 'user_id')[:1000])
+        # recommend builds the model for readers with enough interactions, dormant or not, the others get
+        # the popularity ranking
+        with override_settings(RECOMMEND_ACTIVE_DAYS=None):
+            qualified = training_user_ids(None)
+        self.qualified_user_ids = [user_id for user_id in self.user_ids if user_id in qualified] or self.user_ids
+        self.new_user_ids = [user_id for user_id in user_ids if user_id not in qualified][:AUTH_USERS]
+        self.tokens = {}
+
+    def auth(self, user_id=None):
+        user_id = user_id or self.rng.choice(self.user_ids)
+        if user_id not in self.tokens:
+            # the token's revoke claim hashes the stored password
+            user = User.objects.only('id', 'password').get(id=user_id)
+            self.tokens[user_id] = f'Bearer {AccessToken.for_user(user)}'
+        return {'HTTP_AUTHORIZATION': self.tokens[user_id]}
+
+    def book(self):
+        return self.rng.choice(self.book_ids)
+
+    def get(self, path, data=None, **headers):
+        return self.client.get(path, data, secure=True, **headers)
+
+    def post(self, path, data=None, **headers):
+        return self.client.post(path, data, secure=True, **headers)
+
+    # one request of each benchmarked endpoint
+
+    def books_list(self):
+        return self.get('/books/')
+
+    def book_detail(self):
+        return self.get(f'/books/{self.book()}/')
+
+    def book_search(self):
+        return self.get('/books/', {'search': self.rng.choice(WORDS)})
+
+    def recommend(self):
+        return self.get('/recommend/', **self.auth(self.rng.choice(self.qualified_user_ids)))
+
+    def recommend_popular(self):
+        return self.get('/recommend/', **self.auth(self.rng.choice(self.new_user_ids or self.user_ids)))
+
+    def like_toggle(self):
+        return self.post(f'/books/{self.book()}/like/', **self.auth())
+
+    def share(self):
+        return self.post(f'/books/{self.book()}/share/', **self.auth())
+
+    def rating_create(self):
+        # update_or_create: a new row for most pairs, an update when the reader already rated the book
+        return self.post(f'/books/{self.book()}/rate/', {'grade': self.rng.randint(1, 5)}, **self.auth())
+
+    def rating_update(self):
+        rating_id, user_id = self.rng.choice(self.ratings)
+        return self.client.patch(
+            f'/bookratings/{rating_id}/', {'grade': self.rng.randint(1, 5)}, content_type='application/json',
+            secure=True, **self.auth(user_id),
+        )
+
+
+ENDPOINTS = (
+    'books_list', 'book_detail', 'book_search', 'recommend', 'recommend_popular', 'like_toggle', 'share',
+    'rating_create', 'rating_update',
+)
+
+
+def summarize(latencies, queries, errors):
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'throughput_rps': round(len(latencies) / (latencies.sum() / 1000), 1),
+        'queries_median': int(np.median(queries)),
+        'queries_max': int(max(queries)),
+    }
+
+
+class Command(BaseCommand):
+    help = "Benchmark the main endpoints in-process against seeded datasets, record or compare a JSON baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--datasets', default='small,medium', help=f"Comma separated, of {', '.join(DATASETS)}")
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help="Comma separated endpoints to run")
+        parser.add_argument('--iterations', type=int, default=100, help="Measured requests per endpoint")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Write the results as a JSON baseline to this file")
+        parser.add_argument('--compare', help="Baseline JSON to compare the results against")
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help="Relative p50/p95 slowdown counted as a regression")
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help="Ignore slowdowns smaller than this, in-process timings are noisy")
+
+    def handle(self, *args, **options):
+        datasets = options['datasets'].split(',')
+        endpoints = options['endpoints'].split(',')
+        unknown = [name for name in datasets if name not in DATASETS]
+        unknown += [name for name in endpoints if name not in ENDPOINTS]
+        if unknown:
+            raise CommandError(f"Unknown dataset or endpoint: {', '.join(unknown)}")
+        if REPLICA in connections.databases:
+            raise CommandError("Unset DB_REPLICA_NAME: the benchmark databases are throwaway copies of default only")
+
+        results = {
+            'meta': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'iterations': options['iterations'],
+                'seed': options['seed'],
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'datasets': {},
+        }
+        request_loggers = [logging.getLogger(name) for name in ('bookhub.requests', 'django.request')]
+        levels = [logger.level for logger in request_loggers]
+        setup_test_environment()
+        try:
+            for logger in request_loggers:
+                logger.setLevel(logging.CRITICAL)
+            with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+                for name in datasets:
+                    results['datasets'][name] = self.run_dataset(name, endpoints, options)
+        finally:
+            for logger, level in zip(request_loggers, levels):
+                logger.setLevel(level)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['output']}"))
+        if options['compare']:
+            self.compare(results, options)
+
+    def run_dataset(self, name, endpoints, options):
+        # a throwaway database per dataset, the configured one is never touched
+        with tempfile.TemporaryDirectory() as directory, throwaway_database(directory):
+            size = {**DATASETS[name], 'seed': options['seed']}
+            started = time.perf_counter()
+            call_command('seed_scale', stdout=io.StringIO(), **size)
+            self.stdout.write(f"{name}: seeded {size} in {time.perf_counter() - started:.1f}s")
+
+            workload = Workload(options['seed'])
+            measured = {}
+            for endpoint in endpoints:
+                measured[endpoint] = self.run_endpoint(workload, endpoint, options['iterations'])
+                self.report(name, endpoint, measured[endpoint])
+            return {'size': size, 'endpoints': measured}
+
+    def run_endpoint(self, workload, endpoint, iterations):
+        request = getattr(workload, endpoint)
+        latencies, queries, errors = [], [], 0
+        # views that print debug output would otherwise flood the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(WARMUP):
+                request()
+            for _ in range(min(iterations, MAX_ITERATIONS.get(endpoint, iterations))):
+                started = time.perf_counter()
+                response = request()
+                latencies.append(time.perf_counter() - started)
+                # counted by RequestMetricsMiddleware
+                queries.append(response.wsgi_request.metrics.queries)
+                errors += response.status_code >= 400
+        return summarize(latencies, queries, errors)
+
+    def report(self, dataset, endpoint, stats):
+        self.stdout.write(
+            f"  {endpoint:<17} p50 {stats['p50_ms']:9.2f}ms  p95 {stats['p95_ms']:9.2f}ms  "
+            f"p99 {stats['p99_ms']:9.2f}ms  {stats['throughput_rps']:8.1f} req/s  "
+            f"{stats['queries_median']:4d} queries  {stats['errors']} errors"
+        )
+
+    def compare(self, results, options):
+        with open(options['compare']) as file:
+            baseline = json.load(file)
+        regressions = []
+        for dataset, current in results['datasets'].items():
+            previous = baseline['datasets'].get(dataset)
+            if previous is None:
+                continue
+            for endpoint, stats in current['endpoints'].items():
+                before = previous['endpoints'].get(endpoint)
+                if before is None:
+                    continue
+                for metric in ('p50_ms', 'p95_ms'):
+                    delta = stats[metric] - before[metric]
+                    if delta > options['min_delta_ms'] and stats[metric] > before[metric] * (1 + options['threshold']):
+                        regressions.append(f"{dataset}/{endpoint} {metric} {before[metric]} -> {stats[metric]}")
+                if stats['queries_max'] > before['queries_max']:
+                    regressions.append(
+                        f"{dataset}/{endpoint} queries_max {before['queries_max']} -> {stats['queries_max']}"
+                    )
+
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(f"REGRESSION {regression}"))
+            raise CommandError(f"{len(regressions)} regressions against {options['compare']}")
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
@@ -0,0 +1,117 @@
+import io
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import RequestFactory, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from bookhub.compression import ENCODERS
+from bookhub.instrumentation import RequestMetrics
+from bookhub.models import Book
+from bookhub.renderers import FastJSONRenderer
+from bookhub.replica import REPLICA
+from bookhub.representations import BookRows
+from bookhub.serializers import BookSerializer
+
+from .bench_endpoints import throwaway_database
+
+
+def serializer_data(queryset, request):
+    return BookSerializer(queryset, many=True, context={'request': request}).data
+
+
+def rows_data(queryset, request):
+    rows = BookRows(request)
+    return rows.data(rows.values(queryset))
+
+
+# how a list of books can be turned into response data, from the queryset to the list of dicts
+PATHS = {
+    'serializer': serializer_data,
+    'rows': rows_data,
+}
+
+# how that data becomes the response body
+RENDERERS = {
+    'json': JSONRenderer(),
+    'orjson': FastJSONRenderer(),
+}
+
+SECTIONS = ('build', 'render')
+
+
+def best_of(repeat, function, *args):
+    best = result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class Command(BaseCommand):
+    help = "Measure building (BookSerializer vs BookRows), rendering and compressing book lists of several lengths"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='1000,10000', help="Comma separated list lengths")
+        parser.add_argument('--sections', default=','.join(SECTIONS), help=f"Comma separated, of {', '.join(SECTIONS)}")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement, the best one counts")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        lengths = [int(value) for value in options['rows'].split(',')]
+        sections = options['sections'].split(',')
+        unknown = [name for name in sections if name not in SECTIONS]
+        if unknown:
+            raise CommandError(f"Unknown section: {', '.join(unknown)}")
+        if REPLICA in connections.databases:
+            raise CommandError("Unset DB_REPLICA_NAME: the benchmark database is a throwaway copy of default only")
+
+        with tempfile.TemporaryDirectory() as directory, throwaway_database(directory), \
+                override_settings(MEDIA_ROOT=directory):
+            call_command(
+                'seed_scale', stdout=io.StringIO(), users=500, books=max(lengths), density=0.01, seed=options['seed']
+            )
+            request = Request(RequestFactory().get('/books/', secure=True))
+            for length in lengths:
+                queryset = Book.objects.order_by('id')[:length]
+                if 'build' in sections:
+                    self.build(length, queryset, request, options['repeat'])
+                if 'render' in sections:
+                    self.render(length, rows_data(queryset, request), options['repeat'])
+
+    def build(self, length, queryset, request, repeat):
+        # queries included, that is what a view pays; a fresh queryset every run, nothing comes from its cache
+        results = {}
+        for name, path in PATHS.items():
+            metrics = RequestMetrics()
+            with connection.execute_wrapper(metrics):
+                elapsed, _ = best_of(repeat, lambda: path(queryset.all(), request))
+            results[name] = elapsed
+            self.stdout.write(
+                f"{length:>6} rows  build   {name:<10} {elapsed * 1000:9.1f}ms  {length / elapsed:10.0f} rows/s  "
+                f"{metrics.queries // repeat:6d} queries"
+            )
+        speedup = results['serializer'] / results['rows']
+        self.stdout.write(self.style.SUCCESS(f"{length:>6} rows  BookRows builds {speedup:.1f}x faster"))
+
+    def render(self, length, data, repeat):
+        results = {}
+        for name, renderer in RENDERERS.items():
+            elapsed, body = best_of(repeat, renderer.render, data)
+            results[name] = elapsed
+            self.stdout.write(f"{length:>6} rows  render  {name:<10} {elapsed * 1000:9.1f}ms  {len(body):10d} bytes")
+        speedup = results['json'] / results['orjson']
+        self.stdout.write(self.style.SUCCESS(f"{length:>6} rows  FastJSONRenderer renders {speedup:.1f}x faster"))
+
+        for coding, encode in ENCODERS.items():
+            elapsed, compressed = best_of(repeat, encode, body)
+            self.stdout.write(
+                f"{length:>6} rows  encode  {coding:<10} {elapsed * 1000:9.1f}ms  {len(compressed):10d} bytes  "
+                f"{len(body) / len(compressed):5.1f}x smaller"
+            )
@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Django's sqlite3 default busy timeout, used by both profiles
+TIMEOUT = 5.0
+
+
+def _writer(path, pragmas, begin, seconds, results):
+    # mimics a like toggle: read the current state, then write inside one transaction
+    conn = sqlite3.connect(path, timeout=TIMEOUT, isolation_level=None)
+    for pragma, value in pragmas.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    commits = errors = 0
+    user_id = os.getpid()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        book_id = commits % 50
+        try:
+            conn.execute(begin)
+            liked = conn.execute(
+                "SELECT 1 FROM likes WHERE user_id = ? AND book_id = ?", (user_id, book_id)
+            ).fetchone()
+            if liked:
+                conn.execute("DELETE FROM likes WHERE user_id = ? AND book_id = ?", (user_id, book_id))
+            else:
+                conn.execute("INSERT INTO likes (user_id, book_id) VALUES (?, ?)", (user_id, book_id))
+            conn.execute("COMMIT")
+            commits += 1
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+    conn.close()
+    results.put((commits, errors))
+
+
+def _reader(path, pragmas, begin, seconds, results):
+    # a read-only atomic block, e.g. a view wrapping its queries in transaction.atomic()
+    conn = sqlite3.connect(path, timeout=TIMEOUT, isolation_level=None)
+    for pragma, value in pragmas.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    transactions = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            conn.execute(begin)
+            conn.execute("SELECT COUNT(*) FROM likes WHERE book_id = ?", (transactions % 50,)).fetchone()
+            conn.execute("COMMIT")
+            transactions += 1
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+    conn.close()
+    results.put((transactions, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent SQLite write throughput, and the read-only transactions running alongside, with "
+        "Django's default connection setup vs SQLITE_PRAGMAS with deferred and immediate BEGIN"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help="Concurrent writer processes (gunicorn workers)")
+        parser.add_argument(
+            '--readers', type=int, default=2,
+            help="Concurrent processes running read-only transactions, which BEGIN IMMEDIATE also serializes"
+        )
+        parser.add_argument('--seconds', type=float, default=5.0, help="Duration of each run")
+
+    def handle(self, *args, **options):
+        profiles = {
+            # what every connection got before backend.sqlite3: rollback journal, deferred BEGIN
+            'default': ({}, 'BEGIN'),
+            # the pragmas alone: isolates what BEGIN IMMEDIATE costs the read-only transactions
+            'deferred': (settings.SQLITE_PRAGMAS, 'BEGIN'),
+            'tuned': (settings.SQLITE_PRAGMAS, 'BEGIN IMMEDIATE'),
+        }
+        for name, (pragmas, begin) in profiles.items():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                setup = sqlite3.connect(path)
+                setup.execute("CREATE TABLE likes (user_id INTEGER, book_id INTEGER, PRIMARY KEY (user_id, book_id))")
+                setup.close()
+
+                results, read_results = multiprocessing.Queue(), multiprocessing.Queue()
+                args = (path, pragmas, begin, options['seconds'])
+                writers = [
+                    multiprocessing.Process(target=_writer, args=(*args, results))
+                    for _ in range(options['processes'])
+                ]
+                readers = [
+                    multiprocessing.Process(target=_reader, args=(*args, read_results))
+                    for _ in range(options['readers'])
+                ]
+                for process in writers + readers:
+                    process.start()
+                totals = [results.get() for _ in writers]
+                read_totals = [read_results.get() for _ in readers]
+                for process in writers + readers:
+                    process.join()
+
+            commits = sum(commits for commits, _ in totals)
+            errors = sum(errors for _, errors in totals)
+            self.stdout.write(
+                f"{name:>8}: {commits / options['seconds']:9.0f} commits/s, "
+                f"{errors} 'database is locked' errors ({options['processes']} writers)"
+            )
+            if readers:
+                transactions = sum(transactions for transactions, _ in read_totals)
+                errors = sum(errors for _, errors in read_totals)
+                self.stdout.write(
+                    f"{'':>8}  {transactions / options['seconds']:9.0f} read-only transactions/s, "
+                    f"{errors} 'database is locked' errors ({options['readers']} readers)"
+                )
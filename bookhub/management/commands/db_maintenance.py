@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bookhub.search import FTS_TABLE, PAGE_FTS_TABLE
+
+
+class Command(BaseCommand):
+    help = "Routine SQLite upkeep: planner statistics, FTS segment merges, incremental vacuum, WAL checkpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=1000, help="Free pages to release with incremental_vacuum")
+        parser.add_argument(
+            '--enable-incremental-vacuum', action='store_true',
+            help="Switch the database to auto_vacuum=INCREMENTAL (runs one full VACUUM, needs an exclusive lock)",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("db_maintenance only applies to SQLite databases")
+
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA auto_vacuum")
+            auto_vacuum = cursor.fetchone()[0]
+            if options['enable_incremental_vacuum'] and auto_vacuum != 2:
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                cursor.execute("VACUUM")
+                auto_vacuum = 2
+                self.stdout.write("Enabled incremental vacuum")
+
+            cursor.execute("ANALYZE")
+            cursor.execute("PRAGMA optimize")
+            self.stdout.write("Refreshed planner statistics")
+
+            for table in (FTS_TABLE, PAGE_FTS_TABLE):
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [table])
+                if cursor.fetchone():
+                    cursor.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+            self.stdout.write("Merged full-text index segments")
+
+            if auto_vacuum == 2:
+                cursor.execute("PRAGMA freelist_count")
+                free_pages = cursor.fetchone()[0]
+                cursor.execute(f"PRAGMA incremental_vacuum({int(options['pages'])})")
+                self.stdout.write(f"Released up to {options['pages']} of {free_pages} free pages")
+            else:
+                self.stdout.write("Skipped incremental vacuum, run once with --enable-incremental-vacuum")
+
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            busy, log_frames, checkpointed = cursor.fetchone()
+            self.stdout.write(f"WAL checkpoint: {checkpointed}/{log_frames} frames{' (busy)' if busy else ''}")
+
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,173 @@
+import contextlib
+import io
+import json
+import logging
+import re
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from bookhub.models import Book, BookRating
+from bookhub.replica import REPLICA
+
+from .bench_endpoints import DATASETS, Workload, throwaway_database
+
+# the requests behind each hot path; every SQL statement they run is explained
+HOT_PATHS = {
+    'books_list': lambda workload: workload.books_list(),
+    'books_by_title': lambda workload: workload.get('/books/', {'ordering': 'title'}),
+    'books_by_genre': lambda workload: workload.get('/books/', {'genre': 1}),
+    'book_search': lambda workload: workload.book_search(),
+    'book_detail': lambda workload: workload.book_detail(),
+    'book_ratings': lambda workload: workload.get(f'/books/{workload.book()}/rate/'),
+    'autocomplete': lambda workload: workload.get('/books/autocomplete/', {'q': 'dra'}),
+    'content_search': lambda workload: workload.get('/books/search/content/', {'q': 'dragon'}),
+    'recommend': lambda workload: workload.recommend(),
+    'recommend_popular': lambda workload: workload.recommend_popular(),
+    'like_toggle': lambda workload: workload.like_toggle(),
+    'share': lambda workload: workload.share(),
+    'rating_create': lambda workload: workload.rating_create(),
+    'rating_update': lambda workload: workload.rating_update(),
+}
+
+# full reads by design, reported but not flagged
+EXPECTED_SCANS = {
+    ('autocomplete', 'bookhub_book'): 'the prefix index is rebuilt from every book',
+}
+
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+SCAN_RE = re.compile(r'^SCAN (?P<table>\w+)(?: USING (?P<index>(?:COVERING )?INDEX \w+))?')
+# LIMIT of the outer statement, not of a subquery
+OUTER_LIMIT_RE = re.compile(r'\bLIMIT (?:\d+|%s)(?: OFFSET (?:\d+|%s))?\s*$')
+
+
+def watched_tables():
+    return {
+        Book._meta.db_table, BookRating._meta.db_table,
+        Book.likes.through._meta.db_table, Book.shares.through._meta.db_table,
+    }
+
+
+class StatementRecorder:
+    """
+    connection.execute_wrapper keeping the distinct statements of a request with their first parameters.
+    """
+
+    def __init__(self):
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(EXPLAINED):
+            entry = self.statements.setdefault(sql, {'params': params, 'count': 0})
+            entry['count'] += 1
+        return execute(sql, params, many, context)
+
+
+def suggest_index(table, sql):
+    # columns of the scanned table compared in WHERE / ON, the usual candidates for an index
+    columns = re.findall(rf'"{table}"\."(\w+)" (?:=|<|>|<=|>=|IN|IS) (?:%s|\(|\d|\'|NULL)', sql)
+    columns = list(dict.fromkeys(columns))
+    if columns:
+        return f'CREATE INDEX ... ON "{table}" ({", ".join(columns)})'
+    return f'no filter on "{table}": add a LIMIT or an index matching the ORDER BY'
+
+
+def analyze(path, sql, plan, tables):
+    """
+    Full scans of watched tables in one statement's plan. A scan in index or rowid order that the LIMIT cuts
+    short (no temp b-tree sort) is reported as bounded and not flagged, as are EXPECTED_SCANS.
+    """
+    limited = OUTER_LIMIT_RE.search(sql) is not None
+    sorted_in_memory = any('USE TEMP B-TREE FOR ORDER BY' in detail for detail in plan)
+    scans = []
+    for detail in plan:
+        match = SCAN_RE.match(detail)
+        if not match or match['table'] not in tables:
+            continue
+        bounded = limited and not sorted_in_memory
+        expected = EXPECTED_SCANS.get((path, match['table']))
+        flagged = not bounded and not expected
+        scans.append({
+            'table': match['table'],
+            'detail': detail,
+            'using': match['index'],
+            'bounded': bounded,
+            'expected': expected,
+            'flagged': flagged,
+            'suggestion': suggest_index(match['table'], sql) if flagged else None,
+        })
+    return scans
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN QUERY PLAN every query of the hot request paths and report full scans of the main tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', default=','.join(HOT_PATHS), help="Comma separated hot paths to explain")
+        parser.add_argument('--dataset', default='small', choices=DATASETS, help="seed_scale dataset to run against")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+        parser.add_argument('--fail-on-scan', action='store_true', help="Exit non-zero when a scan is flagged")
+
+    def handle(self, *args, **options):
+        paths = options['paths'].split(',')
+        unknown = [name for name in paths if name not in HOT_PATHS]
+        if unknown:
+            raise CommandError(f"Unknown hot path: {', '.join(unknown)}")
+        if connection.vendor != 'sqlite':
+            raise CommandError("explain_hot_paths reads SQLite's EXPLAIN QUERY PLAN output")
+        if REPLICA in connections.databases:
+            raise CommandError("Unset DB_REPLICA_NAME: the audit runs on a throwaway copy of default only")
+
+        request_logger = logging.getLogger('bookhub.requests')
+        level = request_logger.level
+        setup_test_environment()
+        try:
+            request_logger.setLevel(logging.CRITICAL)
+            with tempfile.TemporaryDirectory() as directory, throwaway_database(directory), \
+                    override_settings(MEDIA_ROOT=directory):
+                call_command(
+                    'seed_scale', stdout=io.StringIO(), seed=options['seed'], **DATASETS[options['dataset']]
+                )
+                report = self.explain_paths(paths, Workload(options['seed']))
+        finally:
+            request_logger.setLevel(level)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        for finding in report['findings']:
+            self.stderr.write(f"SCAN {finding['path']}: {finding['detail']} -> {finding['suggestion']}")
+        if report['findings'] and options['fail_on_scan']:
+            raise CommandError(f"{len(report['findings'])} full scans on hot paths")
+
+    def explain_paths(self, paths, workload):
+        tables = watched_tables()
+        report = {'paths': {}, 'findings': []}
+        for name in paths:
+            recorder = StatementRecorder()
+            # views that print debug output would otherwise end up in the JSON
+            with connection.execute_wrapper(recorder), contextlib.redirect_stdout(io.StringIO()):
+                status = HOT_PATHS[name](workload).status_code
+
+            statements = []
+            for sql, entry in recorder.statements.items():
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', entry['params'])
+                    plan = [row[-1] for row in cursor.fetchall()]
+                scans = analyze(name, sql, plan, tables)
+                statements.append({'sql': sql, 'count': entry['count'], 'plan': plan, 'scans': scans})
+                report['findings'] += [
+                    {'path': name, 'sql': sql, **scan} for scan in scans if scan['flagged']
+                ]
+            report['paths'][name] = {'status': status, 'statements': statements}
+        return report
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from bookhub.extraction import extract_book_text
+from bookhub.models import Book
+
+
+class Command(BaseCommand):
+    help = "Index the pdf text of books whose file changed since the last extraction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int, help="Books to extract, all books by default")
+
+    def handle(self, *args, **options):
+        book_ids = options['book_ids'] or Book.objects.order_by('id').values_list('id', flat=True)
+        extracted = 0
+        for book_id in book_ids:
+            if extract_book_text(book_id):
+                extracted += 1
+        self.stdout.write(self.style.SUCCESS(f"Extracted text of {extracted} book(s)"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from bookhub.models import Book
+from bookhub.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Render cover thumbnails for books whose picture changed since the last run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int, help="Books to process, all books by default")
+
+    def handle(self, *args, **options):
+        book_ids = options['book_ids'] or Book.objects.order_by('id').values_list('id', flat=True)
+        generated = 0
+        for book_id in book_ids:
+            if generate_thumbnails(book_id):
+                generated += 1
+        self.stdout.write(self.style.SUCCESS(f"Generated thumbnails for {generated} book(s)"))
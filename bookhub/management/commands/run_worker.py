@@ -0,0 +1,41 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from bookhub.jobs import queue_depth, requeue_stale_jobs, work
+
+
+class Command(BaseCommand):
+    help = "Process background jobs (text extraction, thumbnails, ...) from the database queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Number of worker threads")
+        parser.add_argument('--drain', action='store_true', help="Exit once no job is due instead of polling")
+        parser.add_argument('--status', action='store_true', help="Print the queue depth per status and exit")
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for status, count in queue_depth().items():
+                self.stdout.write(f"{status}: {count}")
+            return
+
+        requeue_stale_jobs()
+        stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+        threads = [
+            threading.Thread(target=work, args=(stop, options['drain']), name=f'worker-{number}')
+            for number in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
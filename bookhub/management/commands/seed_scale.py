@@ -0,0 +1,210 @@
+import datetime
+import time
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bookhub.models import Book, BookRating, Genre, User
+
+# seeded users get this email domain, which is how --clear finds them and their books again
+SEED_DOMAIN = 'seed.example.com'
+SEED_PASSWORD = 'seed-password'
+
+STUB_PDF = (
+    b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n'
+    b'2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n'
+    b'3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n'
+    b'trailer<</Root 1 0 R>>\n%%EOF\n'
+)
+# 1x1 transparent GIF
+STUB_PICTURE = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,' \
+               b'\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+
+WORDS = (
+    'dragon', 'river', 'night', 'silver', 'garden', 'empire', 'shadow', 'winter', 'ocean', 'crown',
+    'forest', 'glass', 'storm', 'letter', 'city', 'secret', 'fire', 'star', 'island', 'machine',
+)
+
+
+def zipf_weights(count, skew, rng):
+    # popularity ~ 1 / rank^skew, ranks shuffled so popularity does not follow the ids
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def sample_pairs(users, books, target, skew, rng):
+    """
+    `target` distinct (user index, book index) pairs, both sides drawn with Zipfian skew:
+    a few readers are very active and a few books very popular, like in production.
+    """
+    user_weights = zipf_weights(users, skew, rng)
+    book_weights = zipf_weights(books, skew, rng)
+    pairs = np.empty(0, dtype=np.int64)
+    # share of fresh draws that were new pairs, skewed draws keep colliding on the popular ones
+    yield_ratio = 1.0
+    for _ in range(50):
+        missing = target - len(pairs)
+        if missing <= 0:
+            break
+        size = int(missing / yield_ratio * 1.2) + 16
+        drawn = rng.choice(users, size, p=user_weights) * books + rng.choice(books, size, p=book_weights)
+        merged = np.concatenate([pairs, drawn])
+        merged.sort()
+        merged = merged[np.concatenate(([True], merged[1:] != merged[:-1]))]
+        yield_ratio = max((len(merged) - len(pairs)) / size, 0.01)
+        pairs = merged
+    if len(pairs) > target:
+        pairs = np.sort(rng.choice(pairs, target, replace=False))
+    # sorted by user then book, which keeps the unique (user, book) index inserts sequential
+    return pairs // books, pairs % books
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a reproducible synthetic dataset: users, genres, books, likes, shares and ratings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--density', type=float, default=0.01,
+                            help="Share of the user x book cells with a rating")
+        parser.add_argument('--like-ratio', type=float, default=0.3, help="Share of the rated books also liked")
+        parser.add_argument('--share-ratio', type=float, default=0.05, help="Share of the rated books also shared")
+        parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of user activity and book popularity")
+        parser.add_argument('--active-ratio', type=float, default=0.3,
+                            help="Share of users with a last_active in the past month, the rest are dormant")
+        parser.add_argument('--genres', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows per INSERT batch")
+        parser.add_argument('--clear', action='store_true', help="Delete previously seeded rows first")
+
+    def handle(self, *args, **options):
+        seeded_users = User.objects.filter(email__endswith=f'@{SEED_DOMAIN}')
+        if options['clear']:
+            with transaction.atomic():
+                # interactions first: without receivers these are plain DELETEs instead of cascade collection
+                deleted = BookRating.objects.filter(user__in=seeded_users).delete()[0]
+                deleted += Book.likes.through.objects.filter(user__in=seeded_users).delete()[0]
+                deleted += Book.shares.through.objects.filter(user__in=seeded_users).delete()[0]
+                deleted += Book.objects.filter(author__in=seeded_users).delete()[0]
+                deleted += seeded_users.delete()[0]
+            self.stdout.write(f"Deleted {deleted} seeded rows")
+        elif seeded_users.exists():
+            raise CommandError("The database already has seeded users, run with --clear to replace them")
+
+        users, books = options['users'], options['books']
+        if users < 1 or books < 1 or not 0 < options['density'] <= 1:
+            raise CommandError("--users and --books must be positive and --density in (0, 1]")
+
+        rng = np.random.default_rng(options['seed'])
+        self.chunk_size = options['chunk_size']
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            user_ids = self.create_users(users, options['active_ratio'], rng)
+            genre_ids = self.create_genres(options['genres'])
+            book_ids = self.create_books(books, user_ids, genre_ids, rng)
+
+            target = int(users * books * options['density'])
+            user_index, book_index = sample_pairs(users, books, target, options['skew'], rng)
+            user_ids, book_ids = np.asarray(user_ids), np.asarray(book_ids)
+            rated_users, rated_books = user_ids[user_index], book_ids[book_index]
+
+            ratings = self.create_ratings(rated_users, rated_books, rng)
+            liked = rng.random(len(rated_users)) < options['like_ratio']
+            likes = self.create_links(Book.likes.through, rated_users[liked], rated_books[liked])
+            shared = rng.random(len(rated_users)) < options['share_ratio']
+            shares = self.create_links(Book.shares.through, rated_users[shared], rated_books[shared])
+
+        elapsed = time.perf_counter() - started
+        interactions = ratings + likes + shares
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {users} users, {books} books, {ratings} ratings, {likes} likes and {shares} shares "
+            f"({interactions} interactions) in {elapsed:.1f}s, {interactions / elapsed:.0f} interactions/s"
+        ))
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.chunk_size)
+
+    def create_users(self, count, active_ratio, rng):
+        # one hash for everyone: hashing a password per user would take minutes
+        password = make_password(SEED_PASSWORD)
+        now = timezone.now()
+        # active users were seen in the past month, dormant ones one to two years ago
+        days_ago = np.where(rng.random(count) < active_ratio, rng.uniform(0, 30, count), rng.uniform(365, 730, count))
+        first_id = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        for start in range(0, count, self.chunk_size):
+            self.bulk_create(User, [
+                User(
+                    email=f'user{n}@{SEED_DOMAIN}', password=password, first_name='Seed', last_name=f'User{n}',
+                    last_active=now - datetime.timedelta(days=float(days_ago[n])),
+                )
+                for n in range(start, min(start + self.chunk_size, count))
+            ])
+        # SQLite only returns ids from bulk_create on 3.35+, read them back instead
+        return list(
+            User.objects.filter(email__endswith=f'@{SEED_DOMAIN}', id__gte=first_id).order_by('id')
+            .values_list('id', flat=True)
+        )
+
+    def create_genres(self, count):
+        existing = list(Genre.objects.values_list('id', flat=True))
+        if len(existing) >= count:
+            return existing[:count]
+        self.bulk_create(Genre, [Genre(name=f'Genre {n}') for n in range(len(existing), count)])
+        return list(Genre.objects.values_list('id', flat=True))
+
+    def create_books(self, count, author_ids, genre_ids, rng):
+        # every book points at the same stub blob, content addressed storage keeps one copy of each
+        pdf = Book.pdfFile.field.storage.save('seed.pdf', ContentFile(STUB_PDF))
+        picture = Book.picture.field.storage.save('seed.gif', ContentFile(STUB_PICTURE))
+        authors = rng.choice(author_ids, count)
+        genres = rng.choice(genre_ids, count)
+        words = rng.integers(len(WORDS), size=(count, 2))
+
+        first_id = (Book.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        for start in range(0, count, self.chunk_size):
+            self.bulk_create(Book, [
+                Book(
+                    title=f'{WORDS[words[n, 0]]} {WORDS[words[n, 1]]} {n}'.capitalize(),
+                    description=f'Synthetic book {n}.',
+                    pdfFile=pdf, picture=picture, size=len(STUB_PDF),
+                    author_id=int(authors[n]), genre_id=int(genres[n]),
+                    picture_thumbnails={'source': picture, 'sizes': {}},
+                )
+                for n in range(start, min(start + self.chunk_size, count))
+            ])
+        return list(Book.objects.filter(id__gte=first_id).order_by('id').values_list('id', flat=True))
+
+    def insert_rows(self, model, fields, rows):
+        # interactions skip bulk_create: building a model instance per row costs more than the INSERT itself
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+        sql = f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({', '.join(['%s'] * len(fields))})"
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), self.chunk_size):
+                cursor.executemany(sql, rows[start:start + self.chunk_size])
+        return len(rows)
+
+    def create_ratings(self, user_ids, book_ids, rng):
+        grades = rng.integers(1, 6, len(user_ids)).astype(float).tolist()
+        # some ratings are reads without a grade
+        graded = (rng.random(len(user_ids)) < 0.7).tolist()
+        microseconds = rng.exponential(45, len(user_ids)).astype(np.int64) * 60_000_000
+        if connection.features.has_native_duration_field:
+            reading_times = [datetime.timedelta(microseconds=value) for value in microseconds.tolist()]
+        else:
+            reading_times = microseconds.tolist()
+        rows = list(zip(
+            user_ids.tolist(), book_ids.tolist(),
+            [grade if is_graded else None for grade, is_graded in zip(grades, graded)],
+            reading_times,
+        ))
+        return self.insert_rows(BookRating, ('user', 'book', 'grade', 'reading_time'), rows)
+
+    def create_links(self, through, user_ids, book_ids):
+        return self.insert_rows(through, ('user', 'book'), list(zip(user_ids.tolist(), book_ids.tolist())))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from bookhub.replica import REPLICA
+
+
+class Command(BaseCommand):
+    help = "Refresh the SQLite read replica with an online backup of the default database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=4096, help="Pages copied per backup step")
+
+    def handle(self, *args, **options):
+        if REPLICA not in connections.databases:
+            raise CommandError("No replica database configured, set DB_REPLICA_NAME")
+        source, replica = connections['default'], connections[REPLICA]
+        if source.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError("snapshot_replica only copies SQLite databases")
+
+        source.ensure_connection()
+        replica.ensure_connection()
+        # the backup API copies a consistent snapshot without blocking writers, and writes it through an ordinary
+        # connection to the replica: workers holding the file open see the new pages once it commits, with the
+        # replica's own WAL and locks intact, instead of a file swapped from under them
+        source.connection.backup(replica.connection, pages=options['pages'])
+        self.stdout.write(self.style.SUCCESS(f"Replica refreshed at {replica.settings_dict['NAME']}"))
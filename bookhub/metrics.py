@@ -0,0 +1,120 @@
+import hmac
+import os
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from .jobs import queue_depth
+from .profiling import is_staff
+
+# With PROMETHEUS_MULTIPROC_DIR set (see entrypoint.sh) every gunicorn worker writes its samples
+# to mmap'd files in that directory and a scrape of any worker aggregates all of them.
+
+REQUESTS = Counter(
+    'bookhub_http_requests_total', 'Requests handled, by view, method and status.',
+    ['view', 'method', 'status'],
+)
+REQUEST_LATENCY = Histogram(
+    'bookhub_http_request_duration_seconds', 'Request latency, by view.',
+    ['view'], buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+REQUEST_QUERIES = Histogram(
+    'bookhub_http_request_queries', 'SQL queries run per request, by view.',
+    ['view'], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+RECOMMEND_BUILD = Histogram(
+    'bookhub_recommend_build_seconds', 'Time to build the recommendation model.',
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+RECOMMEND_MATRIX_SHAPE = Gauge(
+    'bookhub_recommend_matrix_dimension', 'Rows (users) and columns (books) of the last rating matrix.',
+    ['axis'], multiprocess_mode='mostrecent',
+)
+RECOMMEND_MATRIX_NNZ = Gauge(
+    'bookhub_recommend_matrix_nnz', 'Non zero cells of the last rating matrix.',
+    multiprocess_mode='mostrecent',
+)
+RECOMMEND_MATRIX_BYTES = Gauge(
+    'bookhub_recommend_matrix_bytes', 'Memory of the last recommendation build, by matrix.',
+    ['matrix'], multiprocess_mode='mostrecent',
+)
+CACHE_REQUESTS = Counter(
+    'bookhub_cache_requests_total', 'Lookups of in-process caches, by cache and hit/miss.',
+    ['cache', 'result'],
+)
+
+
+def observe_request(view, method, status, duration, queries):
+    view = view or 'unmatched'
+    REQUESTS.labels(view, method, status).inc()
+    REQUEST_LATENCY.labels(view).observe(duration)
+    REQUEST_QUERIES.labels(view).observe(queries)
+
+
+def observe_recommend_build(duration, **matrices):
+    """
+    Record one recommendation build; `matrices` maps a name to its numpy array, the first one
+    being the user x book rating matrix.
+    """
+    RECOMMEND_BUILD.observe(duration)
+    ratings = next(iter(matrices.values()))
+    RECOMMEND_MATRIX_SHAPE.labels('users').set(ratings.shape[0])
+    RECOMMEND_MATRIX_SHAPE.labels('books').set(ratings.shape[1])
+    RECOMMEND_MATRIX_NNZ.set(int((ratings != 0).sum()))
+    for name, matrix in matrices.items():
+        RECOMMEND_MATRIX_BYTES.labels(name).set(matrix.nbytes)
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+class JobQueueCollector:
+    """
+    Reads the background queue depth from the database at scrape time, so it is right whichever worker answers.
+    """
+
+    def collect(self):
+        depth = GaugeMetricFamily('bookhub_job_queue_depth', 'Jobs in the background queue, by status.',
+                                  labels=['status'])
+        for status, count in queue_depth().items():
+            depth.add_metric([status], count)
+        yield depth
+
+
+class _DefaultCollector:
+    # the metrics of this process only, when running without a multiprocess directory
+    def collect(self):
+        return REGISTRY.collect()
+
+
+def registry():
+    collected = CollectorRegistry()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.MultiProcessCollector(collected)
+    else:
+        collected.register(_DefaultCollector())
+    collected.register(JobQueueCollector())
+    return collected
+
+
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+@require_GET
+def metrics_view(request):
+    # Prometheus text exposition; with METRICS_TOKEN set the scraper has to send it as a bearer token.
+    # Without one only a scraper on the same host (gunicorn sees the peer address, no proxy in front) and staff
+    # users get it, everyone else a 404
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'.encode()
+        if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode(), expected):
+            return HttpResponseForbidden()
+    elif request.META.get('REMOTE_ADDR') not in LOCAL_ADDRESSES and not is_staff(request):
+        raise Http404
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
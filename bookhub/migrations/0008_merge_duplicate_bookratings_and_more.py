@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-19 10:12
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_ratings(apps, schema_editor):
+    BookRating = apps.get_model('bookhub', 'BookRating')
+    duplicates = (
+        BookRating.objects.values('user_id', 'book_id')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for pair in duplicates:
+        ratings = list(
+            BookRating.objects.filter(user_id=pair['user_id'], book_id=pair['book_id']).order_by('id')
+        )
+        # keep the newest row, carry over summed reading time and the latest grade/comment
+        keep = ratings[-1]
+        keep.reading_time = sum(
+            (rating.reading_time for rating in ratings if rating.reading_time), datetime.timedelta(0)
+        )
+        for rating in reversed(ratings):
+            if keep.grade is None and rating.grade is not None:
+                keep.grade = rating.grade
+            if not keep.comment and rating.comment:
+                keep.comment = rating.comment
+        keep.save()
+        BookRating.objects.filter(id__in=[rating.id for rating in ratings[:-1]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookhub', '0007_alter_bookrating_reading_time'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bookrating',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='unique_user_book_rating'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-19 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookhub', '0009_book_title_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookrating',
+            index=models.Index(fields=['book', 'id'], name='bookrating_book_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 11:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookhub', '0010_bookrating_book_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='pdf_text_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
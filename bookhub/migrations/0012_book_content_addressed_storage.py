@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-19 11:52
+
+import bookhub.uploads
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookhub', '0011_book_pdf_text_sha256'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='pdfFile',
+            field=models.FileField(storage=bookhub.uploads.ContentAddressedStorage(), upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='picture',
+            field=models.ImageField(storage=bookhub.uploads.ContentAddressedStorage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-19 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookhub', '0012_book_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='picture_thumbnails',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-19 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookhub', '0014_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookrating',
+            index=models.Index(fields=['book', 'grade', 'id'], name='bookrating_book_grade_idx'),
+        ),
+    ]
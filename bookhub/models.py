@@ -2,8 +2,10 @@ import datetime
 
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 from .managers import UserManager
+from .uploads import book_file_storage
 
 
 class User(AbstractUser):
@@ -34,13 +36,23 @@ class Genre(models.Model):
 class Book(models.Model):
     title = models.CharField(max_length=25)
     description = models.TextField()
-    pdfFile = models.FileField()
+    pdfFile = models.FileField(storage=book_file_storage)
     size = models.PositiveIntegerField()
     genre = models.ForeignKey(Genre, on_delete=models.SET_NULL, null=True)
     likes = models.ManyToManyField(User, blank=True, related_name="likes")
     shares = models.ManyToManyField(User, blank=True, related_name="shares")
     author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="book_author")
-    picture = models.ImageField()
+    picture = models.ImageField(storage=book_file_storage)
+    # {"source": picture name, "sizes": {"<width>": {"webp": name, "jpeg": name}}}, filled in the background
+    picture_thumbnails = models.JSONField(blank=True, null=True, editable=False)
+    # sha256 of the pdf whose text is currently in the page index, blank until extracted
+    pdf_text_sha256 = models.CharField(max_length=64, blank=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # keyset pagination when the list is ordered by title
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -52,4 +64,49 @@ class BookRating(models.Model):
     comment = models.TextField(max_length=2000, null =True, blank = True)
     grade = models.FloatField(null=True, blank=True)
     reading_time = models.DurationField(
-        default=datetime.timedelta(days=0, hours=0, minutes=0, seconds=0, milliseconds=0, microseconds=0),null=True, blank=True)
\ No newline at end of file
+        default=datetime.timedelta(days=0, hours=0, minutes=0, seconds=0, milliseconds=0, microseconds=0),null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # one rating row per reader and book; the unique index also serves (user, book) lookups
+            models.UniqueConstraint(fields=['user', 'book'], name='unique_user_book_rating'),
+        ]
+        indexes = [
+            # per-book review listing, newest first
+            models.Index(fields=['book', 'id'], name='bookrating_book_id_idx'),
+            # the same listing ?ordering=grade, the keyset cursor filters on (grade, id)
+            models.Index(fields=['book', 'grade', 'id'], name='bookrating_book_grade_idx'),
+        ]
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    task = models.CharField(max_length=100)
+    args = models.JSONField(default=list, blank=True)
+    # at most one queued job per key, e.g. "extract_book_text:17"
+    dedup_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(status='queued'), name='unique_queued_job_dedup_key'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.task}{tuple(self.args)} [{self.status}]'
@@ -0,0 +1,122 @@
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination over an indexed ordering, so deep pages cost the same as the first one.
+    Honours the first OrderingFilter field and always breaks ties on the primary key.
+
+    The cursor position is the (value, id) pair of the row it points at, and the next page starts strictly
+    after it: equal values, NULLs included, page on the id instead of DRF's offsets (which stop at
+    offset_cutoff). SQLite sorts NULLs first, so they come before every value ascending and after them
+    descending; the filters below follow that instead of coalescing, which keeps the plain column indexes usable.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        field = super().get_ordering(request, queryset, view)[0]
+        if field.lstrip('-') in ('id', 'pk'):
+            return (field,)
+        # only the first field is part of the position, so it is the only one sorted on
+        return (field, '-id' if field.startswith('-') else 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset, filtering on the (value, id) position
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = queryset.filter(self.after(current_position, reverse))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def after(self, position, reverse):
+        """
+        Q for the rows past `position` in the direction being read: a later value, or the same one and a later id.
+        """
+        try:
+            value, pk = json.loads(position)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        field = self.ordering[0]
+        descending = field.startswith('-') != reverse
+        later = 'lt' if descending else 'gt'
+        later_id = Q(**{f'pk__{later}': pk})
+        if len(self.ordering) == 1:
+            return later_id
+
+        name = field.lstrip('-')
+        if value is None:
+            after = Q(**{f'{name}__isnull': True}) & later_id
+            return after if descending else after | Q(**{f'{name}__isnull': False})
+        after = Q(**{f'{name}__{later}': value}) | (Q(**{name: value}) & later_id)
+        return after | Q(**{f'{name}__isnull': True}) if descending else after
+
+    def _get_position_from_instance(self, instance, ordering):
+        name = ordering[0].lstrip('-')
+        if isinstance(instance, dict):
+            # .values() rows carry related lookups such as author__first_name under the full name
+            pk = instance['id']
+            value = pk if name in ('id', 'pk') else instance[name]
+        else:
+            # follow related lookups such as author__first_name
+            pk = value = instance.pk
+            if name not in ('id', 'pk'):
+                value = instance
+                for part in name.split('__'):
+                    if value is None:
+                        break
+                    value = getattr(value, part)
+        return json.dumps([None if value is None else str(value), pk])
@@ -0,0 +1,102 @@
+import cProfile
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+
+# cProfile and tracemalloc are per process, so one profiled request at a time; the others run as usual
+_profiling = threading.Lock()
+
+
+def requested_modes(request):
+    # `X-Profile: 1` or `?_profile=1` for cProfile, `memory` for cProfile plus tracemalloc
+    value = request.META.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+    if not value or value in ('0', 'false'):
+        return None
+    return {'cpu', 'memory'} if value == 'memory' else {'cpu'}
+
+
+def is_staff(request):
+    # the API authenticates in the view (JWT), so resolve the user here with the same authenticators
+    if getattr(request, 'user', None) is not None and request.user.is_authenticated:
+        return request.user.is_staff
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        return bool(drf_request.user and drf_request.user.is_staff)
+    except APIException:
+        return False
+
+
+def rotate(directory, keep):
+    # each profile is a group of files sharing the reference id prefix, drop the oldest groups
+    groups = {}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        groups.setdefault(name.split('.', 1)[0], []).append(path)
+    oldest = sorted(groups, key=lambda ref: min(os.path.getmtime(path) for path in groups[ref]))
+    for ref in oldest[:max(len(groups) - keep, 0)]:
+        for path in groups[ref]:
+            os.remove(path)
+
+
+class ProfilingMiddleware:
+    """
+    Runs a staff user's request under cProfile (and tracemalloc with `memory`) when it asks for it with the
+    X-Profile header or the _profile query parameter. Writes <id>.prof and <id>.alloc.txt to PROFILE_DIR,
+    keeping the last PROFILE_KEEP profiles, and returns the id in an X-Profile-Id header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        modes = requested_modes(request)
+        if not modes or not is_staff(request) or not _profiling.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request, modes)
+        finally:
+            _profiling.release()
+
+    def profile(self, request, modes):
+        reference = f'{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        base = os.path.join(settings.PROFILE_DIR, reference)
+
+        trace_memory = 'memory' in modes and not tracemalloc.is_tracing()
+        if trace_memory:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        try:
+            # the innermost middleware: the view, serializers and response rendering all run in here
+            response = profiler.runcall(self.get_response, request)
+        finally:
+            if trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        profiler.dump_stats(f'{base}.prof')
+        if trace_memory:
+            self.write_allocations(f'{base}.alloc.txt', request, snapshot, peak)
+        rotate(settings.PROFILE_DIR, settings.PROFILE_KEEP)
+
+        response['X-Profile-Id'] = reference
+        return response
+
+    @staticmethod
+    def write_allocations(path, request, snapshot, peak):
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        with open(path, 'w') as file:
+            file.write(f'{request.method} {request.get_full_path()}\npeak {peak / 1024:.1f} KiB\n\n')
+            for stat in snapshot.statistics('lineno')[:settings.PROFILE_ALLOCATIONS_TOP]:
+                file.write(f'{stat}\n')
@@ -0,0 +1,39 @@
+from django.http import HttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # everything renders through the stdlib json module instead
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer producing the same compact UTF-8 output with orjson, several times faster on large lists.
+    Types orjson does not know (Decimal, timedelta, lazy strings, datetimes) go through DRF's JSONEncoder.
+    Indented output (the browsable API, `; indent=` media types) and installs without orjson use the parent.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # datetimes pass through to DRF's encoder too, so UTC keeps its "Z" suffix
+        ret = orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        # same strict javascript subset as the parent
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class FastJsonResponse(HttpResponse):
+    """
+    JsonResponse for plain Django views, rendered by FastJSONRenderer.
+    """
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', FastJSONRenderer.media_type)
+        super().__init__(content=FastJSONRenderer().render(data), **kwargs)
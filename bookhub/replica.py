@@ -0,0 +1,103 @@
+import contextlib
+import contextvars
+
+from django.conf import settings
+from django.db import connections
+
+REPLICA = 'replica'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+def replica_enabled():
+    return REPLICA in connections.databases
+
+
+@contextlib.contextmanager
+def _reads_from(replica):
+    token = _use_replica.set(replica)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def read_from_replica():
+    """
+    Route the reads inside the block to the replica, e.g. for heavy management commands.
+    """
+    return _reads_from(True)
+
+
+def read_from_default():
+    """
+    Keep the reads inside the block on the default database, even in a view marked for the replica. For rows
+    that must be current, such as the user a token is checked against.
+    """
+    return _reads_from(False)
+
+
+def use_read_replica(view):
+    """
+    Mark a function view whose GET requests may read from the replica. Class based views set `read_replica = True`.
+    """
+    view.read_replica = True
+    return view
+
+
+class ReplicaRouter:
+    """
+    Reads go to the replica only inside read_from_replica() or a marked view; everything else,
+    and every write, stays on the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_enabled():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replica is a snapshot of default, see `manage.py snapshot_replica`
+        return db != REPLICA
+
+
+class ReplicaMiddleware:
+    """
+    Sends safe requests to marked views to the replica. A client that just wrote gets a short lived cookie
+    pinning its reads to the default database, so it reads its own writes while the replica catches up.
+    """
+    pin_cookie = 'primary_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.read_replica = False
+        try:
+            response = self.get_response(request)
+        finally:
+            token = getattr(request, '_replica_token', None)
+            if token is not None:
+                _use_replica.reset(token)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replica_enabled():
+            response.set_cookie(
+                self.pin_cookie, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        marked = getattr(view_func, 'read_replica', False) or getattr(view_class, 'read_replica', False)
+        if marked and request.method in SAFE_METHODS and not request.COOKIES.get(self.pin_cookie):
+            request.read_replica = True
+            request._replica_token = _use_replica.set(True)
+        return None
@@ -0,0 +1,126 @@
+from operator import itemgetter
+
+from django.db.models import Count, Exists, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils.encoding import filepath_to_uri
+
+from .fieldsets import requested_fields
+from .instrumentation import timed
+from .models import Book, BookRating
+from .thumbnails import thumbnail_storage
+
+
+def related_count(through):
+    # correlated COUNT over the (book_id, user_id) index, evaluated for the returned rows only
+    counts = through.objects.filter(book_id=OuterRef('pk')).order_by().values('book_id').annotate(count=Count('*'))
+    return Coalesce(Subquery(counts.values('count'), output_field=IntegerField()), 0)
+
+
+# columns computed in SQL rather than read from the table
+COUNT_ANNOTATIONS = {
+    'likes_count': lambda: related_count(Book.likes.through),
+    'shares_count': lambda: related_count(Book.shares.through),
+}
+
+
+def book_detail_queryset(request, fields):
+    """
+    Books for BookSingleSerializer, joining, counting and prefetching only what `fields` will read.
+    """
+    fields = set(fields)
+    queryset = Book.objects.all()
+    if fields & {'authorFirstName', 'authorLastName'}:
+        queryset = queryset.select_related('author')
+    if 'genreName' in fields:
+        queryset = queryset.select_related('genre')
+    if 'likesCount' in fields:
+        queryset = queryset.annotate(likes_count=COUNT_ANNOTATIONS['likes_count']())
+    if 'sharesCount' in fields:
+        queryset = queryset.annotate(shares_count=COUNT_ANNOTATIONS['shares_count']())
+    if 'is_liked' in fields:
+        queryset = queryset.annotate(liked_by_user=Exists(
+            Book.likes.through.objects.filter(book_id=OuterRef('pk'), user_id=request.user.id)
+        ))
+    if 'ratings' in fields:
+        queryset = queryset.prefetch_related(Prefetch('ratings', BookRating.objects.select_related('user').only(
+            'id', 'book_id', 'grade', 'reading_time', 'comment', 'user__id', 'user__first_name', 'user__last_name'
+        )))
+    return queryset
+
+
+class BookRows:
+    """
+    Read-only BookSerializer output built from `.values()` rows: the same keys and values, but plain dict
+    construction with the URL prefixes resolved once instead of DRF fields per row, and the counts and names
+    selected in the same query. Used for GET lists and recommendations; writes keep BookSerializer.
+
+    With ?fields= / ?omit= only the requested keys are built, and only their columns, joins and counts queried.
+    """
+
+    # output key -> the .values() columns it is built from, in BookSerializer's field order
+    columns = {
+        'id': ('id',),
+        'title': ('title',),
+        'description': ('description',),
+        'pdfFile': ('pdfFile',),
+        'size': ('size',),
+        'genreName': ('genre__name',),
+        'picture': ('picture',),
+        'pictureSrcset': ('picture_thumbnails',),
+        'likesCount': ('likes_count',),
+        'sharesCount': ('shares_count',),
+        'authorFirstName': ('author__first_name',),
+        'authorLastName': ('author__last_name',),
+    }
+
+    def __init__(self, request=None, absolute_urls=True):
+        # storage.url('') is the storage's base URL, absolute like FileField's when there is a request
+        url_request = request if absolute_urls else None
+        self.file_prefix = self.absolute(Book.pdfFile.field.storage.url(''), url_request)
+        self.thumbnail_prefix = self.absolute(thumbnail_storage.url(''), url_request)
+        # pdfs are served by the book_file view; its URL is reversed once, around a placeholder id
+        self.book_file_url = self.absolute(reverse('book-file', args=[0]), url_request).replace('/0/', '/{}/')
+
+        builders = {
+            'pdfFile': lambda row: self.book_file_url.format(row['id']) if row['pdfFile'] else None,
+            'picture': lambda row: self.file_url(row['picture']),
+            'pictureSrcset': lambda row: self.srcset(row['picture_thumbnails']),
+        }
+        self.fields = requested_fields(request, self.columns)
+        self.builders = [
+            (field, builders.get(field) or itemgetter(*self.columns[field])) for field in self.fields
+        ]
+
+    @staticmethod
+    def absolute(url, request):
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def values(self, queryset, extra=()):
+        """
+        The queryset as rows carrying the columns of the requested fields, the id and `extra`. Annotations
+        already on it (e.g. search_rank) are kept, cursor pagination reads its position from them.
+        """
+        columns = {'id', *extra}
+        for field in self.fields:
+            columns.update(self.columns[field])
+        counts = {name: COUNT_ANNOTATIONS[name]() for name in COUNT_ANNOTATIONS if name in columns}
+        return queryset.annotate(**counts).values(*columns.union(queryset.query.annotations))
+
+    def file_url(self, name):
+        return self.file_prefix + filepath_to_uri(name) if name else None
+
+    def srcset(self, thumbnails):
+        sizes = (thumbnails or {}).get('sizes', {})
+        srcset = {}
+        for width in sorted(sizes, key=int):
+            for extension, name in sizes[width].items():
+                srcset.setdefault(extension, []).append(f'{self.thumbnail_prefix}{filepath_to_uri(name)} {width}w')
+        return {extension: ', '.join(candidates) for extension, candidates in srcset.items()}
+
+    def to_representation(self, row):
+        return {field: build(row) for field, build in self.builders}
+
+    def data(self, rows):
+        with timed('serializer'):
+            return [self.to_representation(row) for row in rows]
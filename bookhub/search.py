@@ -0,0 +1,186 @@
+from django.db import connections
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+FTS_TABLE = 'bookhub_book_fts'
+PAGE_FTS_TABLE = 'bookhub_bookpage_fts'
+
+# page index rowids pack the book id and page number: rowid = book_id << PAGE_BITS | page
+PAGE_BITS = 20
+
+# bm25 column weights: title, description, author
+BM25_WEIGHTS = (10.0, 1.0, 5.0)
+
+AUTHOR_NAME_SQL = "(SELECT first_name || ' ' || last_name FROM bookhub_user WHERE id = new.author_id)"
+
+FTS_TRIGGERS = {
+    'bookhub_book_fts_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS bookhub_book_fts_ai AFTER INSERT ON bookhub_book BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, description, author)
+            VALUES (new.id, new.title, new.description, {AUTHOR_NAME_SQL});
+        END
+    """,
+    'bookhub_book_fts_au': f"""
+        CREATE TRIGGER IF NOT EXISTS bookhub_book_fts_au
+        AFTER UPDATE OF title, description, author_id ON bookhub_book BEGIN
+            UPDATE {FTS_TABLE}
+            SET title = new.title, description = new.description, author = {AUTHOR_NAME_SQL}
+            WHERE rowid = new.id;
+        END
+    """,
+    'bookhub_book_fts_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS bookhub_book_fts_ad AFTER DELETE ON bookhub_book BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        END
+    """,
+    'bookhub_bookpage_fts_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS bookhub_bookpage_fts_ad AFTER DELETE ON bookhub_book BEGIN
+            DELETE FROM {PAGE_FTS_TABLE}
+            WHERE rowid BETWEEN old.id << {PAGE_BITS} AND ((old.id + 1) << {PAGE_BITS}) - 1;
+        END
+    """,
+    'bookhub_user_fts_au': f"""
+        CREATE TRIGGER IF NOT EXISTS bookhub_user_fts_au
+        AFTER UPDATE OF first_name, last_name ON bookhub_user BEGIN
+            UPDATE {FTS_TABLE} SET author = new.first_name || ' ' || new.last_name
+            WHERE rowid IN (SELECT id FROM bookhub_book WHERE author_id = new.id);
+        END
+    """,
+}
+
+
+def drop_fts_triggers(using='default', **kwargs):
+    """
+    Runs before every migrate: SQLite table rebuilds fail while triggers reference the table being rebuilt.
+    ensure_fts_index puts them back afterwards.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name in FTS_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def ensure_fts_index(using='default', **kwargs):
+    """
+    Create the FTS5 tables and their sync triggers if any of them is missing and refill the book index.
+    Runs after every migrate, since the triggers are dropped for the duration of the migration.
+    The page index is filled by pdf text extraction (see extraction.py), not from SQL.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE name IN (%s, %s) OR (type = 'trigger' AND name LIKE 'bookhub_%%_fts_%%')",
+            [FTS_TABLE, PAGE_FTS_TABLE],
+        )
+        present = {row[0] for row in cursor.fetchall()}
+        if present >= {FTS_TABLE, PAGE_FTS_TABLE, *FTS_TRIGGERS}:
+            return
+
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(title, description, author, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {PAGE_FTS_TABLE} "
+            f"USING fts5(text, tokenize='unicode61 remove_diacritics 2')"
+        )
+        for sql in FTS_TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(f"""
+            INSERT INTO {FTS_TABLE}(rowid, title, description, author)
+            SELECT book.id, book.title, book.description, author.first_name || ' ' || author.last_name
+            FROM bookhub_book book LEFT JOIN bookhub_user author ON author.id = book.author_id
+        """)
+
+
+def search_pages(terms, limit, using='default'):
+    """
+    Best matching pages for the terms as (book_id, page, snippet) rows, page numbers starting at 1.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or not terms:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid >> {PAGE_BITS}, rowid & {(1 << PAGE_BITS) - 1}, "
+            f"snippet({PAGE_FTS_TABLE}, 0, '**', '**', '…', 16) "
+            f"FROM {PAGE_FTS_TABLE} WHERE {PAGE_FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s",
+            [match_query(terms), limit],
+        )
+        return cursor.fetchall()
+
+
+def replace_book_pages(book_id, pages, using='default'):
+    """
+    Swap the indexed text of a book for `pages`, a list of page texts in order.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    first = book_id << PAGE_BITS
+    pages = pages[:(1 << PAGE_BITS) - 1]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {PAGE_FTS_TABLE} WHERE rowid BETWEEN %s AND %s", [first, first + (1 << PAGE_BITS) - 1]
+        )
+        cursor.executemany(
+            f"INSERT INTO {PAGE_FTS_TABLE}(rowid, text) VALUES (%s, %s)",
+            [(first + number, text) for number, text in enumerate(pages, 1) if text.strip()],
+        )
+
+
+def match_query(terms):
+    # every term is quoted (no FTS operators from user input) and prefix-matched
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    ?search= backed by the FTS5 index, annotating each book with its bm25 `search_rank`
+    (lower is better). Falls back to the regular LIKE search on other databases.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        if connections[queryset.db].vendor != 'sqlite':
+            return super().filter_queryset(request, queryset, view).annotate(
+                search_rank=Value(0.0, output_field=FloatField())
+            )
+
+        weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {queryset.model._meta.db_table}.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match_query(terms)],
+        ).annotate(search_rank=RawSQL(f'bm25({FTS_TABLE}, {weights})', (), output_field=FloatField()))
+
+
+class RankedOrderingFilter(OrderingFilter):
+    """
+    OrderingFilter that orders by relevance while a search is active and no explicit ordering was asked for.
+    """
+
+    def searching(self, request):
+        return bool(request.query_params.get(SearchFilter.search_param, '').strip())
+
+    def get_default_ordering(self, view):
+        if self.searching(view.request):
+            return ('search_rank',)
+        return super().get_default_ordering(view)
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        valid = super().remove_invalid_fields(queryset, fields, view, request)
+        if not self.searching(request):
+            # there is no rank to order by without a search
+            valid = [term for term in valid if term.lstrip('-') != 'search_rank']
+        return valid
@@ -1,10 +1,14 @@
 from rest_framework import serializers
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from .fieldsets import SparseFieldsetMixin
+from .instrumentation import TimedListSerializer, TimedSerializerMixin
 from .models import Genre, Book, BookRating, User
+from .thumbnails import thumbnail_storage
 from django.contrib.auth import authenticate
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
+from django.urls import reverse
 
 from django.conf import settings
 
@@ -78,20 +82,47 @@ class MainUserSerializer(serializers.ModelSerializer):
         extra_kwargs = {'password': {'write_only': True}}
 
 
-class GenreSerializer(serializers.ModelSerializer):
+class GenreSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Genre
         fields = ('id', 'name')
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookFileField(serializers.FileField):
+    """
+    Uploads like FileField, but points at the book_file view (ETag, Range, X-Accel) instead of the media URL.
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = reverse('book-file', args=[value.instance.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class UploadSizeMixin:
+    """
+    Book serializers take the size from the uploaded file, never from the client.
+    """
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if 'pdfFile' in attrs:
+            attrs['size'] = attrs['pdfFile'].size
+        return attrs
+
+
+class BookSerializer(UploadSizeMixin, TimedSerializerMixin, serializers.ModelSerializer):
     likesCount = serializers.SerializerMethodField()
     sharesCount = serializers.SerializerMethodField()
     genreName = serializers.SerializerMethodField()
     authorFirstName = serializers.SerializerMethodField()
     authorLastName = serializers.SerializerMethodField()
     picture = serializers.ImageField()
-    pdfFile = serializers.FileField()
+    pictureSrcset = serializers.SerializerMethodField()
+    pdfFile = BookFileField()
 
     def get_likesCount(self, obj):
         return obj.likes.count()
@@ -108,14 +139,29 @@ class BookSerializer(serializers.ModelSerializer):
     def get_authorLastName(self, obj):
         return obj.author.last_name if obj.author else None
 
+    def get_pictureSrcset(self, obj):
+        # {"webp": "<url> 160w, <url> 320w", "jpeg": ...}, empty until the thumbnails are generated
+        sizes = (obj.picture_thumbnails or {}).get('sizes', {})
+        request = self.context.get('request', None)
+        srcset = {}
+        for width in sorted(sizes, key=int):
+            for extension, name in sizes[width].items():
+                url = thumbnail_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                srcset.setdefault(extension, []).append(f'{url} {width}w')
+        return {extension: ', '.join(candidates) for extension, candidates in srcset.items()}
+
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Book
         fields = (
-            'id', 'title', 'description', 'pdfFile', "author", 'size', "genre", 'genreName', "picture", 'likesCount',
-            'sharesCount', 'authorFirstName', 'authorLastName')
+            'id', 'title', 'description', 'pdfFile', "author", 'size', "genre", 'genreName', "picture",
+            'pictureSrcset', 'likesCount', 'sharesCount', 'authorFirstName', 'authorLastName')
         extra_kwargs = {
             'likes': {'read_only': True},
             'shares': {'read_only': True},
+            'size': {'read_only': True},
             'genre': {'write_only': True},
             'author': {'write_only': True},
         }
@@ -128,7 +174,7 @@ class BookLikeSerializer(serializers.ModelSerializer):
         fields = ('id', 'liked')
 
 
-class BookRatingSerializer(serializers.ModelSerializer):
+class BookRatingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user_name = serializers.SerializerMethodField()
     user_lastname = serializers.SerializerMethodField()
 
@@ -139,6 +185,7 @@ class BookRatingSerializer(serializers.ModelSerializer):
         return obj.user.last_name
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = BookRating
         fields = ('id', 'book', 'grade', 'reading_time', "comment", "user", "user_name", "user_lastname")
 
@@ -148,22 +195,27 @@ class BookRatingSerializer(serializers.ModelSerializer):
         }
 
 
-class BookSingleSerializer(serializers.ModelSerializer):
+class ReadingHeartbeatSerializer(serializers.Serializer):
+    seconds = serializers.IntegerField(min_value=1, max_value=settings.READING_HEARTBEAT_MAX_SECONDS)
+
+
+class BookSingleSerializer(UploadSizeMixin, SparseFieldsetMixin, TimedSerializerMixin, serializers.ModelSerializer):
     likesCount = serializers.SerializerMethodField()
     sharesCount = serializers.SerializerMethodField()
     genreName = serializers.SerializerMethodField()
     authorFirstName = serializers.SerializerMethodField()
     authorLastName = serializers.SerializerMethodField()
     picture = serializers.ImageField()
-    pdfFile = serializers.FileField()
+    pdfFile = BookFileField()
     ratings = BookRatingSerializer(many=True)
     is_liked = serializers.SerializerMethodField()
 
+    # the counts and is_liked come annotated from BookRetrieveUpdateDestroyView's queryset when present
     def get_likesCount(self, obj):
-        return obj.likes.count()
+        return obj.likes_count if hasattr(obj, 'likes_count') else obj.likes.count()
 
     def get_sharesCount(self, obj):
-        return obj.shares.count()
+        return obj.shares_count if hasattr(obj, 'shares_count') else obj.shares.count()
 
     def get_genreName(self, obj):
         return obj.genre.name if obj.genre else None
@@ -175,12 +227,15 @@ class BookSingleSerializer(serializers.ModelSerializer):
         return obj.author.last_name if obj.author else None
 
     def get_is_liked(self, obj):
+        if hasattr(obj, 'liked_by_user'):
+            return obj.liked_by_user
         request = self.context.get('request', None)
         if request and hasattr(request, 'user'):
             return request.user in obj.likes.all()
         return False
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Book
         fields = (
             'id', 'title', 'description', 'pdfFile', "author", 'size', "genre", 'genreName', "picture", 'likesCount',
@@ -188,6 +243,7 @@ class BookSingleSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'likes': {'read_only': True},
             'shares': {'read_only': True},
+            'size': {'read_only': True},
             'genre': {'write_only': True},
             'author': {'write_only': True},
             'is_liked': {'read_only': True, "required": False},
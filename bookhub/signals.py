@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user
+from .autocomplete import author_name, book_prefix_index
+from .extraction import schedule_text_extraction
+from .models import Book, User
+from .thumbnails import schedule_thumbnails
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    if not book_prefix_index.built:
+        return
+    author = instance.author
+    name = author_name(author.first_name, author.last_name) if author else ''
+    transaction.on_commit(
+        lambda: book_prefix_index.update_book(instance.id, instance.title, instance.author_id, name)
+    )
+
+
+@receiver(post_save, sender=Book)
+def extract_book_text_later(sender, instance, update_fields=None, **kwargs):
+    # the extraction itself skips files whose hash did not change
+    if update_fields is None or 'pdfFile' in update_fields:
+        schedule_text_extraction(instance.id)
+
+
+@receiver(post_save, sender=Book)
+def generate_thumbnails_later(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'picture' in update_fields:
+        schedule_thumbnails(instance.id)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    if book_prefix_index.built:
+        transaction.on_commit(lambda: book_prefix_index.remove_book(instance.id))
+
+
+@receiver(post_save, sender=User)
+def reindex_author(sender, instance, created, **kwargs):
+    if book_prefix_index.built and not created:
+        name = author_name(instance.first_name, instance.last_name)
+        transaction.on_commit(lambda: book_prefix_index.update_author(instance.id, name))
+
+
+@receiver(pre_save, sender=User)
+def remember_stored_password(sender, instance, **kwargs):
+    # cached users are keyed by password, so the entry cached under the old one must go as well
+    if not instance._state.adding:
+        instance._stored_password = User.objects.filter(pk=instance.pk).values_list('password', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # the password may be deferred on the instance, don't load it just for this
+    passwords = {getattr(instance, '_stored_password', None), instance.__dict__.get('password')} - {None}
+    # after commit, so a concurrent request can't cache the old row again
+    transaction.on_commit(lambda: invalidate_user(instance.id, *passwords))
@@ -1,3 +1,918 @@
-from django.test import TestCase
+import base64
+import datetime
+import gzip
+import json
+import os
+import pstats
+import sqlite3
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock, skipIf
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import jobs
+from .activity import ActivityTracker, activity_tracker
+from .autocomplete import PrefixIndex
+from .compression import brotli
+from .heartbeat import ReadingTimeBuffer, reading_time_buffer
+from .models import Book, BookRating, Genre, Job, User
+from .replica import REPLICA, ReplicaRouter, read_from_default, read_from_replica
+from .representations import BookRows
+from .search import replace_book_pages, search_pages
+from .serializers import BookSerializer, BookSingleSerializer
+
+
+class BookhubTestMixin:
+    """
+    The process-wide caches and write buffers are reset around every test: ids are reused once a test
+    rolls back, and nothing may be flushed after the test database is gone.
+    """
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+
+    def tearDown(self):
+        activity_tracker.flush()
+        reading_time_buffer.flush()
+        super().tearDown()
+
+    @staticmethod
+    def make_user(email, first_name='Reader', last_name='One', **kwargs):
+        return User.objects.create_user(
+            email=email, password='password', first_name=first_name, last_name=last_name, **kwargs
+        )
+
+    @staticmethod
+    def make_book(title, author=None, genre=None, **kwargs):
+        return Book.objects.create(
+            title=title, description=kwargs.pop('description', ''), pdfFile='book.pdf', picture='cover.gif', size=1,
+            author=author, genre=genre, **kwargs
+        )
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def walk(self, url, key='id', limit=50):
+        """
+        The `key` of every item on every page, following the next links from `url`.
+        """
+        items = []
+        while url and limit:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            items += [item[key] for item in response.data['results']]
+            url = response.data['next']
+            limit -= 1
+        self.assertIsNone(url, 'pagination did not terminate')
+        return items
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class BookhubTestCase(BookhubTestMixin, APITestCase):
+    pass
+
+
+class ReadingHeartbeatTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('reader@example.com')
+        self.book = self.make_book('Heartbeats')
+
+    def test_deltas_are_coalesced_and_added_to_the_stored_time(self):
+        BookRating.objects.create(user=self.user, book=self.book, reading_time=datetime.timedelta(minutes=1))
+        buffer = ReadingTimeBuffer(interval=3600)
+        buffer.add(self.user.id, self.book.id, datetime.timedelta(seconds=30))
+        buffer.add(self.user.id, self.book.id, datetime.timedelta(seconds=30))
+
+        self.assertEqual(buffer.flush(), 1)
+        rating = BookRating.objects.get(user=self.user, book=self.book)
+        self.assertEqual(rating.reading_time, datetime.timedelta(minutes=2))
+        self.assertEqual(buffer.pending(), {})
+
+    def test_flush_creates_the_missing_rating_and_skips_deleted_books(self):
+        deleted = self.make_book('Gone')
+        buffer = ReadingTimeBuffer(interval=3600)
+        buffer.add(self.user.id, self.book.id, datetime.timedelta(seconds=45))
+        buffer.add(self.user.id, deleted.id, datetime.timedelta(seconds=45))
+        deleted.delete()
+
+        buffer.flush()
+        self.assertEqual(
+            list(BookRating.objects.values_list('book_id', 'reading_time')),
+            [(self.book.id, datetime.timedelta(seconds=45))],
+        )
+
+    def test_failed_flush_puts_the_deltas_back(self):
+        buffer = ReadingTimeBuffer(interval=3600)
+        buffer.add(self.user.id, self.book.id, datetime.timedelta(seconds=10))
+        with mock.patch.object(ReadingTimeBuffer, '_write_chunk', side_effect=OperationalError('locked')):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        # a heartbeat arriving after the failure adds up with the requeued delta
+        buffer.add(self.user.id, self.book.id, datetime.timedelta(seconds=5))
+        self.assertEqual(buffer.pending(), {(self.user.id, self.book.id): datetime.timedelta(seconds=15)})
+
+        buffer.flush()
+        self.assertEqual(BookRating.objects.get().reading_time, datetime.timedelta(seconds=15))
+
+    def test_heartbeats_of_deleted_accounts_are_dropped(self):
+        gone = self.make_user('gone@example.com')
+        buffer = ReadingTimeBuffer(interval=3600)
+        buffer.add(gone.id, self.book.id, datetime.timedelta(seconds=30))
+        buffer.add(self.user.id, self.book.id, datetime.timedelta(seconds=30))
+        gone.delete()
+
+        buffer.flush()
+        self.assertEqual(buffer.pending(), {})
+        self.assertEqual(
+            list(BookRating.objects.values_list('user_id', 'reading_time')),
+            [(self.user.id, datetime.timedelta(seconds=30))],
+        )
+
+    def test_a_rejected_pair_is_dropped_without_holding_back_the_others(self):
+        other = self.make_book('Other')
+        buffer = ReadingTimeBuffer(interval=3600)
+        buffer.add(self.user.id, self.book.id, datetime.timedelta(seconds=10))
+        buffer.add(self.user.id, other.id, datetime.timedelta(seconds=20))
+        write_chunk = ReadingTimeBuffer._write_chunk
+
+        def reject_other(buffer, items):
+            if any(book_id == other.id for (_, book_id), _ in items):
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return write_chunk(buffer, items)
+
+        with mock.patch.object(ReadingTimeBuffer, '_write_chunk', reject_other):
+            with self.assertLogs('bookhub.heartbeat', 'ERROR'):
+                self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.pending(), {})
+        self.assertEqual(
+            list(BookRating.objects.values_list('book_id', 'reading_time')),
+            [(self.book.id, datetime.timedelta(seconds=10))],
+        )
+
+    def test_endpoint_buffers_the_heartbeat(self):
+        self.authenticate(self.user)
+        response = self.client.post(f'/books/{self.book.id}/heartbeat/', {'seconds': 20})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(
+            reading_time_buffer.pending(), {(self.user.id, self.book.id): datetime.timedelta(seconds=20)}
+        )
+
+    def test_endpoint_rejects_unknown_books(self):
+        self.authenticate(self.user)
+        response = self.client.post(f'/books/{self.book.id + 100}/heartbeat/', {'seconds': 20})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(reading_time_buffer.pending(), {})
+
+
+class BookRatingUpsertTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('reader@example.com')
+        self.book = self.make_book('Ratings')
+        self.authenticate(self.user)
+
+    def test_posting_again_updates_the_rating(self):
+        response = self.client.post(f'/books/{self.book.id}/rate/', {'grade': 3, 'reading_time': '00:10:00'})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(f'/books/{self.book.id}/rate/', {'grade': 5, 'reading_time': '00:05:00'})
+        self.assertEqual(response.status_code, 200)
+
+        rating = BookRating.objects.get()
+        self.assertEqual(response.data['id'], rating.id)
+        self.assertEqual(rating.grade, 5)
+        # reading time accumulates instead of being overwritten
+        self.assertEqual(rating.reading_time, datetime.timedelta(minutes=15))
+
+    def test_rating_an_unknown_book(self):
+        response = self.client.post(f'/books/{self.book.id + 100}/rate/', {'grade': 3})
+        self.assertEqual(response.status_code, 404)
+
+
+class MergeDuplicateRatingsMigrationTests(TransactionTestCase):
+    before = [('bookhub', '0007_alter_bookrating_reading_time')]
+    after = [('bookhub', '0008_merge_duplicate_bookratings_and_more')]
+
+    def tearDown(self):
+        # back to the latest migration, migrate re-creates the search index and triggers
+        call_command('migrate', 'bookhub', verbosity=0)
+        super().tearDown()
+
+    def test_duplicates_are_merged_into_the_newest_rating(self):
+        call_command('migrate', 'bookhub', self.before[0][1], verbosity=0)
+        apps = MigrationExecutor(connection).loader.project_state(self.before).apps
+        User = apps.get_model('bookhub', 'User')
+        Book = apps.get_model('bookhub', 'Book')
+        BookRating = apps.get_model('bookhub', 'BookRating')
+        user = User.objects.create(email='reader@example.com', first_name='Reader', last_name='One')
+        book = Book.objects.create(title='Twice', description='', pdfFile='book.pdf', picture='cover.gif', size=1)
+        BookRating.objects.create(
+            user=user, book=book, grade=4, comment='first', reading_time=datetime.timedelta(minutes=1)
+        )
+        BookRating.objects.create(user=user, book=book, reading_time=datetime.timedelta(minutes=2))
+        newest = BookRating.objects.create(user=user, book=book, comment='', reading_time=None)
+
+        call_command('migrate', 'bookhub', self.after[0][1], verbosity=0)
+        rating = BookRating.objects.get()
+        self.assertEqual(rating.id, newest.id)
+        self.assertEqual(rating.grade, 4)
+        self.assertEqual(rating.comment, 'first')
+        self.assertEqual(rating.reading_time, datetime.timedelta(minutes=3))
+
+
+class KeysetPaginationTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        ann = self.make_user('ann@example.com', first_name='Ann')
+        bob = self.make_user('bob@example.com', first_name='Bob')
+        self.books = [
+            self.make_book('Anonymous I'),
+            self.make_book('Second', author=bob),
+            self.make_book('First', author=ann),
+            self.make_book('Anonymous II'),
+            self.make_book('Third', author=bob),
+            self.make_book('Anonymous III'),
+        ]
+        self.ids = [book.id for book in self.books]
+
+    def test_walks_every_page_of_the_default_ordering(self):
+        self.assertEqual(self.walk('/books/?page_size=2'), sorted(self.ids, reverse=True))
+
+    def test_walks_every_page_of_a_nullable_ordering(self):
+        anonymous = [self.ids[0], self.ids[3], self.ids[5]]
+        ann, bob = [self.ids[2]], [self.ids[1], self.ids[4]]
+        self.assertEqual(self.walk('/books/?ordering=author__first_name&page_size=2'), anonymous + ann + bob)
+        self.assertEqual(
+            self.walk('/books/?ordering=-author__first_name&page_size=2'),
+            bob[::-1] + ann + anonymous[::-1],
+        )
+
+    def test_previous_links_walk_back(self):
+        url = '/books/?ordering=author__first_name&page_size=4'
+        last = self.client.get(self.client.get(url).data['next'])
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual([book['id'] for book in previous.data['results']], self.walk(url)[:4])
+
+    def test_ties_page_on_the_id_without_offsets(self):
+        url = '/books/?ordering=author__first_name&page_size=1'
+        while url:
+            response = self.client.get(url)
+            url = response.data['next']
+            if url:
+                cursor = parse_qs(urlparse(url).query)['cursor'][0]
+                tokens = parse_qs(base64.b64decode(cursor).decode())
+                self.assertNotIn('o', tokens)
+
+    def test_previous_links_walk_every_page_back(self):
+        url = '/books/?ordering=-author__first_name&page_size=2'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            pages.append([book['id'] for book in response.data['results']])
+            url = response.data['next']
+        url = response.data['previous']
+        while url:
+            response = self.client.get(url)
+            self.assertEqual([book['id'] for book in response.data['results']], pages[-2])
+            pages.pop()
+            url = response.data['previous']
+        self.assertEqual(len(pages), 1)
+
+    def test_malformed_cursors_are_rejected(self):
+        cursor = base64.b64encode(b'p=Ann').decode()
+        response = self.client.get('/books/', {'ordering': 'author__first_name', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+    def test_walks_every_page_of_ratings_by_grade(self):
+        book = self.books[0]
+        grades = [None, 4.5, None, 2.0, 4.5, None]
+        for index, grade in enumerate(grades):
+            user = self.make_user(f'rater{index}@example.com')
+            BookRating.objects.create(user=user, book=book, grade=grade)
+
+        walked = self.walk(f'/books/{book.id}/rate/?ordering=grade&page_size=2', key='grade')
+        self.assertEqual(walked, [None, None, None, 2.0, 4.5, 4.5])
+        walked = self.walk(f'/books/{book.id}/rate/?ordering=-grade&page_size=2', key='grade')
+        self.assertEqual(walked, [4.5, 4.5, 2.0, None, None, None])
+
+
+class FullTextIndexTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_user('writer@example.com', first_name='Ursula', last_name='Leguin')
+        self.book = self.make_book('Wizard of Earthsea', author=self.author, description='A school for mages')
+
+    def search(self, terms):
+        response = self.client.get('/books/', {'search': terms})
+        self.assertEqual(response.status_code, 200)
+        return [book['id'] for book in response.data['results']]
+
+    def test_inserted_books_are_searchable(self):
+        self.assertEqual(self.search('earthsea'), [self.book.id])
+        self.assertEqual(self.search('mages'), [self.book.id])
+        self.assertEqual(self.search('ursula'), [self.book.id])
+
+    def test_updates_replace_the_indexed_text(self):
+        self.book.title = 'The Tombs of Atuan'
+        self.book.save()
+        self.assertEqual(self.search('earthsea'), [])
+        self.assertEqual(self.search('atuan'), [self.book.id])
+
+    def test_author_renames_and_changes_are_indexed(self):
+        self.author.first_name = 'Ged'
+        self.author.save()
+        self.assertEqual(self.search('ursula'), [])
+        self.assertEqual(self.search('ged leguin'), [self.book.id])
+
+        other = self.make_user('other@example.com', first_name='Tenar', last_name='Kargad')
+        self.book.author = other
+        self.book.save()
+        self.assertEqual(self.search('leguin'), [])
+        self.assertEqual(self.search('tenar'), [self.book.id])
+
+    def test_deleted_books_leave_both_indexes(self):
+        replace_book_pages(self.book.id, ['Only a dragon', 'speaks the old speech'])
+        self.assertEqual([row[:2] for row in search_pages(['dragon'], 10)], [(self.book.id, 1)])
+
+        self.book.delete()
+        self.assertEqual(self.search('earthsea'), [])
+        self.assertEqual(search_pages(['dragon'], 10), [])
+
+
+class PrefixIndexTests(BookhubTestCase):
+    def test_stale_index_is_served_while_a_single_rebuild_runs(self):
+        self.make_book('Wings of dragons')
+        index = PrefixIndex()
+        index.search('drag', 5)
+        index._built_at -= settings.AUTOCOMPLETE_REFRESH_SECONDS + 1
+
+        release, rebuilds = threading.Event(), []
+        with mock.patch.object(index, 'rebuild', side_effect=lambda: rebuilds.append(release.wait(5))):
+            for _ in range(3):
+                self.assertEqual([title for _, title, _ in index.search('drag', 5)], ['Wings of dragons'])
+            release.set()
+            # the background rebuild holds the lock until it is done
+            self.assertTrue(index._rebuild_lock.acquire(timeout=5))
+        self.assertEqual(rebuilds, [True])
+
+
+class UploadSizeTests(BookhubTestCase):
+    def test_size_comes_from_the_uploaded_file(self):
+        book = self.make_book('Sized')
+        for serializer_class in (BookSerializer, BookSingleSerializer):
+            upload = SimpleUploadedFile('book.pdf', b'%PDF-1.4 ' + b'x' * 100, content_type='application/pdf')
+            serializer = serializer_class(book, data={'pdfFile': upload, 'size': 1}, partial=True)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            self.assertEqual(serializer.validated_data['size'], upload.size)
+
+
+class BookFileTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, BOOK_FILE_SENDFILE=None))
+        with open(f'{media.name}/book.pdf', 'wb') as pdf:
+            pdf.write(b'%PDF-1.4 ' + b'x' * 100)
+        self.book = self.make_book('Downloadable')
+
+    def test_head_reports_the_file_without_a_body(self):
+        response = self.client.head(f'/books/{self.book.id}/file/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '109')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertFalse(b''.join(response.streaming_content))
+
+    def test_book_representations_link_to_this_view(self):
+        url = f'http://testserver/books/{self.book.id}/file/'
+        self.assertEqual(self.client.get('/books/').data['results'][0]['pdfFile'], url)
+        self.assertEqual(self.client.get(f'/books/{self.book.id}/').data['pdfFile'], url)
+        self.assertEqual(BookSerializer(self.book).data['pdfFile'], f'/books/{self.book.id}/file/')
+
+    def test_ranges_are_served(self):
+        response = self.client.get(f'/books/{self.book.id}/file/', HTTP_RANGE='bytes=0-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4')
+
+
+class JobQueueTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        self.failures = 0
+        self.enterContext(mock.patch.dict(jobs.TASKS, {'record': self.record}))
+
+    def record(self, *args):
+        self.calls.append(args)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('flaky')
+
+    def test_enqueue_rejects_unknown_tasks_and_dedups_waiting_jobs(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('missing')
+        self.assertIsNotNone(jobs.enqueue('record', 1, dedup_key='record:1'))
+        self.assertIsNone(jobs.enqueue('record', 1, dedup_key='record:1'))
+        self.assertIsNotNone(jobs.enqueue('record', 2, dedup_key='record:2'))
+        self.assertEqual(jobs.queue_depth(), {Job.QUEUED: 2, Job.RUNNING: 0, Job.FAILED: 0})
+
+    def test_a_job_is_claimed_once_and_only_when_due(self):
+        jobs.enqueue('record', 'later', delay=datetime.timedelta(minutes=5))
+        job = jobs.enqueue('record', 'now')
+
+        claimed = jobs.claim_job('worker-1')
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual((claimed.status, claimed.locked_by, claimed.attempts), (Job.RUNNING, 'worker-1', 1))
+        self.assertIsNone(jobs.claim_job('worker-2'))
+
+    def test_success_deletes_the_job(self):
+        jobs.enqueue('record', 1, 2)
+        self.assertTrue(jobs.run_job(jobs.claim_job('worker')))
+        self.assertEqual(self.calls, [(1, 2)])
+        self.assertFalse(Job.objects.exists())
+
+    def test_failures_are_retried_with_backoff_then_marked_failed(self):
+        self.failures = 2
+        jobs.enqueue('record', max_attempts=2)
+
+        with self.assertLogs('bookhub.jobs', 'ERROR'):
+            before = timezone.now()
+            self.assertFalse(jobs.run_job(jobs.claim_job('worker')))
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('flaky', job.last_error)
+        self.assertGreaterEqual(job.run_at, before + jobs.retry_delay(1))
+        self.assertIsNone(jobs.claim_job('worker'), 'claimed before the backoff ran out')
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('bookhub.jobs', 'ERROR'):
+            self.assertFalse(jobs.run_job(jobs.claim_job('worker')))
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_retry_backoff_doubles_up_to_an_hour(self):
+        base = settings.JOB_QUEUE_RETRY_BASE_SECONDS
+        self.assertEqual(
+            [jobs.retry_delay(attempts).total_seconds() for attempts in (1, 2, 3)], [base, 2 * base, 4 * base]
+        )
+        self.assertEqual(jobs.retry_delay(30), datetime.timedelta(hours=1))
+
+    def test_a_retry_yields_to_the_same_work_queued_meanwhile(self):
+        self.failures = 1
+        jobs.enqueue('record', 1, dedup_key='record:1')
+        job = jobs.claim_job('worker')
+        # queued again while the first run is in progress
+        self.assertIsNotNone(jobs.enqueue('record', 1, dedup_key='record:1'))
+
+        with self.assertLogs('bookhub.jobs', 'ERROR'):
+            jobs.run_job(job)
+        self.assertEqual(list(Job.objects.values_list('status', 'attempts')), [(Job.QUEUED, 0)])
+
+    @override_settings(JOB_QUEUE_POLL_SECONDS=0.01)
+    def test_the_worker_loop_survives_database_errors(self):
+        jobs.enqueue('record', 1)
+        claim_job, errors = jobs.claim_job, [OperationalError('database is locked')]
+
+        def locked_once(worker_id):
+            if errors:
+                raise errors.pop()
+            return claim_job(worker_id)
+
+        with mock.patch.object(jobs, 'claim_job', locked_once):
+            with self.assertLogs('bookhub.jobs', 'ERROR'):
+                jobs.work(threading.Event(), drain=True)
+        self.assertEqual(self.calls, [(1,)])
+
+    @override_settings(JOB_QUEUE_REQUEUE_SECONDS=0)
+    def test_the_worker_loop_requeues_stale_jobs(self):
+        with mock.patch.object(jobs, 'requeue_stale_jobs') as requeue:
+            jobs.work(threading.Event(), drain=True)
+        requeue.assert_called_once_with()
+
+    def test_jobs_of_dead_workers_are_requeued(self):
+        jobs.enqueue('record')
+        jobs.claim_job('dead-worker')
+        stale = timezone.now() - datetime.timedelta(seconds=settings.JOB_QUEUE_LOCK_TIMEOUT + 1)
+        Job.objects.update(locked_at=stale)
+
+        jobs.requeue_stale_jobs()
+        self.assertTrue(jobs.run_job(jobs.claim_job('worker')))
+
+
+class SqliteBackendTests(TransactionTestCase):
+    def test_new_connections_get_the_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            pass
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+    def test_db_maintenance(self):
+        out = StringIO()
+        call_command('db_maintenance', stdout=out)
+        self.assertIn('Refreshed planner statistics', out.getvalue())
+        self.assertIn('Skipped incremental vacuum', out.getvalue())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ReplicaTests(BookhubTestMixin, APITransactionTestCase):
+    # the backup API can't copy a database while the same connection has a transaction open
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.replica_path = f'{directory.name}/replica.sqlite3'
+        replica = {**connections.databases['default'], 'NAME': self.replica_path}
+        patcher = mock.patch.dict(connections.databases, {REPLICA: replica})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: connections[REPLICA].close() or delattr(connections._connections, REPLICA))
+        self.book = self.make_book('Snapshotted')
+        call_command('snapshot_replica', stdout=StringIO())
+
+    def test_the_router_sends_marked_reads_to_the_replica(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Book))
+        with read_from_replica():
+            self.assertEqual(router.db_for_read(Book), REPLICA)
+            self.assertEqual(router.db_for_write(Book), 'default')
+            with read_from_default():
+                self.assertIsNone(router.db_for_read(Book))
+
+    def test_snapshots_reach_connections_already_open(self):
+        reader = sqlite3.connect(self.replica_path)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.execute("SELECT count(*) FROM bookhub_book").fetchone(), (1,))
+
+        self.make_book('Later')
+        call_command('snapshot_replica', stdout=StringIO())
+        self.assertEqual(reader.execute("SELECT count(*) FROM bookhub_book").fetchone(), (2,))
+
+    def test_marked_views_read_the_replica_until_a_write_pins_the_client(self):
+        later = self.make_book('Later')
+        response = self.client.get('/books/')
+        self.assertTrue(response.wsgi_request.read_replica)
+        self.assertEqual([book['id'] for book in response.data['results']], [self.book.id])
+
+        self.authenticate(self.make_user('reader@example.com'))
+        response = self.client.post(f'/books/{later.id}/like/')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('primary_pin', response.cookies)
+
+        response = self.client.get('/books/')
+        self.assertFalse(response.wsgi_request.read_replica)
+        self.assertEqual([book['id'] for book in response.data['results']], [later.id, self.book.id])
+
+    def test_accounts_newer_than_the_snapshot_authenticate(self):
+        self.authenticate(self.make_user('reader@example.com'))
+        response = self.client.get('/books/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.wsgi_request.read_replica)
+
+
+@override_settings(REQUEST_METRICS_HEADER=False)
+class ServerTimingTests(BookhubTestCase):
+    def test_only_staff_see_the_request_metrics(self):
+        self.assertNotIn('Server-Timing', self.client.get('/books/'))
+
+        self.authenticate(self.make_user('reader@example.com'))
+        self.assertNotIn('Server-Timing', self.client.get('/books/'))
+
+        self.authenticate(self.make_user('staff@example.com', is_staff=True))
+        self.assertIn('queries', self.client.get('/books/')['Server-Timing'])
+
+
+class ProfilingTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings_override = override_settings(PROFILE_DIR=self.directory, PROFILE_KEEP=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_only_staff_requests_are_profiled(self):
+        self.authenticate(self.make_user('reader@example.com'))
+        self.assertNotIn('X-Profile-Id', self.client.get('/books/', HTTP_X_PROFILE='1'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+        self.authenticate(self.make_user('staff@example.com', is_staff=True))
+        self.assertNotIn('X-Profile-Id', self.client.get('/books/'))
+        reference = self.client.get('/books/', HTTP_X_PROFILE='1')['X-Profile-Id']
+        self.assertEqual(os.listdir(self.directory), [f'{reference}.prof'])
+        pstats.Stats(os.path.join(self.directory, f'{reference}.prof'))
+
+    def test_memory_profiles_list_the_top_allocations(self):
+        self.authenticate(self.make_user('staff@example.com', is_staff=True))
+        reference = self.client.get('/books/?_profile=memory')['X-Profile-Id']
+        with open(os.path.join(self.directory, f'{reference}.alloc.txt')) as file:
+            self.assertTrue(file.read().startswith('GET /books/?_profile=memory\npeak '))
+
+    def test_only_the_latest_profiles_are_kept(self):
+        self.authenticate(self.make_user('staff@example.com', is_staff=True))
+        references = [self.client.get('/books/?_profile=memory')['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            sorted(f'{reference}.{suffix}' for reference in references[1:] for suffix in ('prof', 'alloc.txt')),
+        )
+
+
+class MetricsEndpointTests(BookhubTestCase):
+    remote = {'REMOTE_ADDR': '203.0.113.7'}
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_without_a_token_only_localhost_and_staff_get_metrics(self):
+        self.assertEqual(self.client.get('/metrics', **self.remote).status_code, 404)
+        self.authenticate(self.make_user('reader@example.com'))
+        self.assertEqual(self.client.get('/metrics', **self.remote).status_code, 404)
+
+        self.authenticate(self.make_user('staff@example.com', is_staff=True))
+        self.assertEqual(self.client.get('/metrics', **self.remote).status_code, 200)
+        self.client.credentials()
+        response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'bookhub_http_requests_total', response.content)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_a_configured_token_is_required(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(self.client.get('/metrics', **self.remote).status_code, 403)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(self.client.get('/metrics', **self.remote).status_code, 200)
+
+
+class CachedAuthenticationTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('reader@example.com', first_name='Before')
+
+    def get_account(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.client.get('/account/')
+
+    def test_cached_users_skip_the_user_query(self):
+        token = AccessToken.for_user(self.user)
+        first = self.get_account(token).wsgi_request.metrics.queries
+        response = self.get_account(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.metrics.queries, first - 1)
+
+    def test_saving_a_user_drops_the_cached_entry(self):
+        token = AccessToken.for_user(self.user)
+        self.get_account(token)
+        self.user.first_name = 'After'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.get_account(token).data['first_name'], 'After')
+
+    def test_tokens_for_a_new_password_bypass_entries_cached_for_the_old_one(self):
+        old_token = AccessToken.for_user(self.user)
+        self.get_account(old_token)
+        # changed by another worker: this process still caches the user with the old password
+        self.user.set_password('changed')
+        User.objects.filter(pk=self.user.pk).update(password=self.user.password)
+
+        self.assertEqual(self.get_account(AccessToken.for_user(self.user)).status_code, 200)
+
+    def test_a_password_change_revokes_cached_tokens(self):
+        old_token = AccessToken.for_user(self.user)
+        self.get_account(old_token)
+        self.user.set_password('changed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.get_account(old_token).status_code, 401)
+
+
+class ActivityTrackerTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('reader@example.com')
+        self.tracker = ActivityTracker(interval=3600)
+        self.addCleanup(self.tracker.flush)
+
+    def test_a_user_is_queued_once_per_window(self):
+        now = timezone.now()
+        window = datetime.timedelta(seconds=settings.LAST_ACTIVE_WINDOW)
+        self.assertTrue(self.tracker.touch(self.user.id, now))
+        self.assertFalse(self.tracker.touch(self.user.id, now + window / 2))
+        self.assertEqual(self.tracker.pending(), {self.user.id: now})
+        self.assertTrue(self.tracker.touch(self.user.id, now + window))
+        self.assertEqual(self.tracker.pending(), {self.user.id: now + window})
+
+    def test_flush_writes_last_active(self):
+        other = self.make_user('other@example.com')
+        now = timezone.now()
+        self.tracker.touch(self.user.id, now)
+        self.tracker.touch(other.id, now)
+
+        self.assertEqual(self.tracker.flush(), 2)
+        self.assertEqual(set(User.objects.values_list('last_active', flat=True)), {now})
+        self.assertEqual(self.tracker.pending(), {})
+        # still inside the window after the flush
+        self.assertFalse(self.tracker.touch(self.user.id, now))
+
+    def test_failed_flush_requeues_without_overwriting_newer_touches(self):
+        now = timezone.now()
+        self.tracker.touch(self.user.id, now)
+        with mock.patch.object(User.objects, 'bulk_update', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                self.tracker.flush()
+        self.assertEqual(self.tracker.pending(), {self.user.id: now})
+
+        self.tracker.flush()
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_active, now)
+
+    def test_authenticated_requests_mark_the_user_active(self):
+        # the process-wide tracker may still throttle this id from an earlier test
+        with mock.patch('bookhub.activity.activity_tracker', self.tracker):
+            self.client.get('/books/')
+            self.assertEqual(self.tracker.pending(), {})
+
+            self.authenticate(self.user)
+            self.client.get('/books/')
+        self.assertEqual(list(self.tracker.pending()), [self.user.id])
+
+
+class PopularRecommendationTests(BookhubTestCase):
+    def test_new_readers_get_books_by_likes_shares_and_ratings(self):
+        readers = [self.make_user(f'reader{n}@example.com') for n in range(3)]
+        quiet, rated, liked = self.make_book('Quiet'), self.make_book('Rated'), self.make_book('Liked')
+        for reader in readers:
+            liked.likes.add(reader)
+        liked.shares.add(readers[0])
+        for reader in readers[:2]:
+            BookRating.objects.create(user=reader, book=rated, grade=4)
+
+        self.authenticate(self.make_user('new@example.com'))
+        response = self.client.get('/recommend/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [book['id'] for book in response.json()['recommended_books']], [liked.id, rated.id, quiet.id]
+        )
+
+
+class RecommendationModelTests(BookhubTestCase):
+    # as right after the deploy that added last_active: NULL for everyone, and no ratings (reading times) yet
+    def setUp(self):
+        super().setUp()
+        self.shared, self.theirs, self.passed = self.make_book('Shared'), self.make_book('Theirs'), self.make_book('On')
+        self.other = self.make_user('other@example.com')
+        self.shared.likes.add(self.other)
+        self.theirs.likes.add(self.other)
+        self.passed.shares.add(self.other)
+        self.reader = self.make_user('reader@example.com')
+        self.authenticate(self.reader)
+
+    def recommend(self):
+        with mock.patch('bookhub.views.observe_recommend_build') as observe:
+            response = self.client.get('/recommend/')
+        self.assertEqual(response.status_code, 200)
+        return [book['id'] for book in response.json()['recommended_books']], observe.called
+
+    def test_readers_never_seen_active_are_trained_on(self):
+        self.shared.likes.add(self.reader)
+        books, built = self.recommend()
+        self.assertTrue(built)
+        self.assertEqual(sorted(books), [self.theirs.id, self.passed.id])
+
+    def test_a_lone_reader_gets_the_popular_books(self):
+        self.other.delete()
+        self.shared.likes.add(self.reader)
+        self.assertEqual(self.recommend(), ([self.passed.id, self.theirs.id], False))
+
+    def test_interactions_without_signal_get_the_popular_books(self):
+        BookRating.objects.create(user=self.reader, book=self.shared)
+        books, built = self.recommend()
+        self.assertFalse(built)
+        self.assertEqual(books[0], self.shared.id)
+
+
+class BookRowsTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        author = self.make_user('author@example.com', first_name='Ann', last_name='Author')
+        reader = self.make_user('reader@example.com')
+        self.book = self.make_book(
+            'Full', author=author, genre=Genre.objects.create(name='Poetry'), description='Verse',
+            picture_thumbnails={'sizes': {'320': {'webp': 'thumbs/320.webp'}, '160': {'webp': 'thumbs/160.webp'}}},
+        )
+        self.book.likes.add(reader, author)
+        self.book.shares.add(reader)
+        self.make_book('Bare')
+
+    def test_lists_match_the_serializer(self):
+        response = self.client.get('/books/')
+        books = Book.objects.order_by('-id')
+        self.assertEqual(
+            response.json()['results'],
+            BookSerializer(books, many=True, context={'request': response.wsgi_request}).data,
+        )
+
+    def test_relative_urls_match_the_serializer_without_a_request(self):
+        rows = BookRows(absolute_urls=False)
+        books = Book.objects.order_by('-id')
+        self.assertEqual(rows.data(rows.values(books)), BookSerializer(books, many=True).data)
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_BYTES=1024)
+class CompressionTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.book = self.make_book('Long', description='word ' * 400)
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli_is_preferred(self):
+        response = self.client.get('/books/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.content))['results'][0]['id'], self.book.id)
+
+    def test_the_best_accepted_encoding_is_used(self):
+        response = self.client.get('/books/', HTTP_ACCEPT_ENCODING='gzip, br;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['results'][0]['id'], self.book.id)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+    def test_clients_without_an_accepted_encoding_get_plain_json(self):
+        for accept_encoding in ('', 'identity', 'br;q=0, gzip;q=0'):
+            response = self.client.get('/books/', HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertEqual(response.json()['results'][0]['id'], self.book.id)
+            self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get('/books/?fields=id', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertNotIn('Accept-Encoding', response.get('Vary', ''))
+
+    def test_html_is_not_compressed(self):
+        response = self.client.get('/admin/login/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertGreater(len(response.content), 1024)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class SparseFieldsetTests(BookhubTestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = self.make_user('writer@example.com', first_name='Ann')
+        self.book = self.make_book('Sparse', author=self.author, description='Long text')
+        BookRating.objects.create(user=self.author, book=self.book, grade=5)
+
+    def test_list_fields_and_omit(self):
+        response = self.client.get('/books/', {'fields': 'id,title'})
+        self.assertEqual(response.data['results'], [{'id': self.book.id, 'title': 'Sparse'}])
+
+        response = self.client.get('/books/', {'omit': 'description,pdfFile'})
+        row = response.data['results'][0]
+        self.assertNotIn('description', row)
+        self.assertNotIn('pdfFile', row)
+        self.assertEqual(row['authorFirstName'], 'Ann')
+
+    def test_left_out_ordering_columns_still_page(self):
+        self.make_book('Anonymous')
+        ids = self.walk('/books/?ordering=author__first_name&fields=id&page_size=1')
+        self.assertEqual(len(ids), 2)
+
+    def test_detail_queries_only_what_is_requested(self):
+        full = self.client.get(f'/books/{self.book.id}/')
+        sparse = self.client.get(f'/books/{self.book.id}/', {'fields': 'id,title'})
+        self.assertEqual(sparse.data, {'id': self.book.id, 'title': 'Sparse'})
+        self.assertIn('ratings', full.data)
+        # no ratings prefetch
+        self.assertLess(sparse.wsgi_request.metrics.queries, full.wsgi_request.metrics.queries)
+
+    def test_recommendations(self):
+        self.authenticate(self.make_user('new@example.com'))
+        response = self.client.get('/recommend/', {'omit': 'description'})
+        book = response.json()['recommended_books'][0]
+        self.assertNotIn('description', book)
+        self.assertIn('title', book)
+
+        response = self.client.get('/recommend/', {'fields': 'id'})
+        self.assertEqual(response.json()['recommended_books'], [{'id': self.book.id}])
+
+    def test_writes_answer_with_every_field(self):
+        self.authenticate(self.author)
+        response = self.client.patch(f'/books/{self.book.id}/?fields=id', {'title': 'Renamed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Renamed')
+        self.assertIn('ratings', response.data)
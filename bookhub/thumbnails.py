@@ -0,0 +1,76 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, UnidentifiedImageError
+
+from .jobs import enqueue, task
+from .models import Book
+
+# thumbnails are written under their final name right next to the cover, no renaming
+thumbnail_storage = FileSystemStorage()
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def thumbnail_name(picture_name, width, extension):
+    root, _ = os.path.splitext(picture_name)
+    return f'{root}.w{width}.{extension}'
+
+
+def _encode(image, image_format, options):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        # flatten transparency onto white, JPEG has no alpha channel
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+@task
+def generate_thumbnails(book_id):
+    """
+    Render the book cover at every BOOK_COVER_WIDTHS width narrower than the original, in each of FORMATS,
+    and record them in Book.picture_thumbnails. Skipped when the cover did not change since the last run.
+    """
+    book = Book.objects.filter(id=book_id).only('id', 'picture', 'picture_thumbnails').first()
+    if book is None or not book.picture:
+        return False
+    if (book.picture_thumbnails or {}).get('source') == book.picture.name:
+        return False
+
+    try:
+        with book.picture.open('rb'):
+            original = Image.open(book.picture)
+            original.load()
+    except (OSError, UnidentifiedImageError):
+        Book.objects.filter(id=book.id).update(picture_thumbnails={'source': book.picture.name, 'sizes': {}})
+        return False
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+
+    sizes = {}
+    for width in sorted(settings.BOOK_COVER_WIDTHS):
+        if width >= original.width:
+            break
+        height = max(round(original.height * width / original.width), 1)
+        resized = original.resize((width, height), Image.LANCZOS)
+        for extension, (image_format, options) in FORMATS.items():
+            name = thumbnail_name(book.picture.name, width, extension)
+            if not thumbnail_storage.exists(name):
+                thumbnail_storage.save(name, ContentFile(_encode(resized, image_format, options)))
+            sizes.setdefault(str(width), {})[extension] = name
+
+    Book.objects.filter(id=book.id).update(picture_thumbnails={'source': book.picture.name, 'sizes': sizes})
+    return True
+
+
+def schedule_thumbnails(book_id):
+    enqueue('generate_thumbnails', book_id, dedup_key=f'generate_thumbnails:{book_id}')
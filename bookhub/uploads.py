@@ -0,0 +1,70 @@
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.deconstruct import deconstructible
+
+BLOB_DIR = 'blobs'
+BLOB_NAME_RE = re.compile(rf'^{BLOB_DIR}/[0-9a-f]{{2}}/(?P<sha256>[0-9a-f]{{64}})(\.\w+)?$')
+
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams every upload to a temporary file (never into memory) and hashes it in the same pass.
+    The finished file carries its hex digest as `sha256`.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+
+def content_sha256(content):
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def blob_sha256(name):
+    # the hash is part of every content addressed name, no need to read the file again
+    match = BLOB_NAME_RE.match(name or '')
+    return match.group('sha256') if match else None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores files under blobs/<aa>/<sha256><ext>, so identical uploads share a single file on disk.
+    Files are never deleted together with a book, which keeps shared blobs safe.
+    """
+
+    def save(self, name, content, max_length=None):
+        name = name or content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        sha256 = content_sha256(content)
+        extension = os.path.splitext(name)[1].lower()
+        name = f'{BLOB_DIR}/{sha256[:2]}/{sha256}{extension}'
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+book_file_storage = ContentAddressedStorage()
@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenRefreshView, TokenObtainPairView
 
+from .metrics import metrics_view
 from .views import (
     GenreListCreateView, GenreRetrieveUpdateDestroyView,
     BookListCreateView, BookRetrieveUpdateDestroyView,
     BookRatingListCreateView, BookRatingRetrieveUpdateDestroyView, recommend, UserRegistrationView, LoginView,
-    BookLikeView, BookShareView, UserView, BookListMyView,
+    BookLikeView, BookShareView, UserView, BookListMyView, ReadingHeartbeatView,
+    autocomplete, BookContentSearchView, book_file,
 )
 
 urlpatterns = [
@@ -23,7 +25,10 @@ urlpatterns = [
     # Book URLs
     path('books/', BookListCreateView.as_view(), name='book-list-create'),
     path('books/my/', BookListMyView.as_view(), name='book-list-create'),
+    path('books/autocomplete/', autocomplete, name='book-autocomplete'),
+    path('books/search/content/', BookContentSearchView.as_view(), name='book-content-search'),
     path('books/<int:pk>/', BookRetrieveUpdateDestroyView.as_view(), name='book-retrieve-update-destroy'),
+    path('books/<int:pk>/file/', book_file, name='book-file'),
 
     # do route books/1/share/
     # BookRating URLs
@@ -33,7 +38,11 @@ urlpatterns = [
 
     path("books/<int:book_id>/like/", BookLikeView.as_view(), name="book_like"),
     path("books/<int:book_id>/share/", BookShareView.as_view(), name="book_share"),
+    path("books/<int:book_id>/heartbeat/", ReadingHeartbeatView.as_view(), name="book_heartbeat"),
 
-    path("recommend/", recommend)
+    path("recommend/", recommend),
+
+    # Prometheus scrapes /metrics without a trailing slash
+    path('metrics', metrics_view, name='metrics'),
 
 ]
\ No newline at end of file
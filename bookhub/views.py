@@ -1,25 +1,42 @@
 import datetime
 import json
+import time
+from collections import Counter
 
 import numpy as np
 import pandas as pd
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.views.decorators.http import require_GET, require_safe
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics
 from rest_framework import status
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.generics import CreateAPIView, RetrieveUpdateDestroyAPIView
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import api_view
 
+from .autocomplete import book_prefix_index
+from .delivery import serve_book_file
+from .fieldsets import requested_fields
+from .heartbeat import reading_time_buffer
+from .metrics import observe_recommend_build
+from .renderers import FastJsonResponse
+from .replica import use_read_replica
+from .representations import BookRows, book_detail_queryset, related_count
 from .models import Genre, Book, BookRating, User
+from .search import FullTextSearchFilter, RankedOrderingFilter, search_pages
 from .permissions import IsSuperUserOrReadOnly, IsBookOwnerOrReadOnly, IsOwner, IsAccountOwner, IsAuthor
 from .serializers import GenreSerializer, BookSerializer, BookRatingSerializer, UserSerializer, \
-    LoginSerializer, MainUserSerializer, BookSingleSerializer
+    LoginSerializer, MainUserSerializer, BookSingleSerializer, ReadingHeartbeatSerializer
 
-from django.db.models import Exists, OuterRef, Subquery
+from django.db import router
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
 from sklearn.model_selection import train_test_split
 from sklearn.metrics.pairwise import pairwise_distances
 from django.db.models import Min
@@ -31,6 +48,9 @@ def predict_ratings(ratings, similarity):
 
 
 def scale_down_to_5(value, x):
+    # missing reading times (NaT, or None when no training user has one) are filled with 0 afterwards
+    if pd.isnull(value) or pd.isnull(x):
+        return np.nan
     try:
         res = (value.total_seconds() / x.total_seconds()) * 5
     except ZeroDivisionError:
@@ -39,6 +59,42 @@ def scale_down_to_5(value, x):
     return res
 
 
+def training_user_ids(current_user_id):
+    """
+    Users the recommendation model is built from: at least RECOMMEND_MIN_INTERACTIONS likes, shares and
+    ratings, and active within RECOMMEND_ACTIVE_DAYS (None for everyone). The requesting user counts as active,
+    and so does everyone not seen since last_active was introduced (NULL), rather than nobody right after a deploy.
+    """
+    interactions = Counter()
+    for through in (Book.likes.through, Book.shares.through, BookRating):
+        counts = through.objects.values_list('user_id').annotate(count=Count('pk')).order_by()
+        interactions.update(dict(counts))
+    user_ids = {
+        user_id for user_id, count in interactions.items() if count >= settings.RECOMMEND_MIN_INTERACTIONS
+    }
+
+    if settings.RECOMMEND_ACTIVE_DAYS is not None:
+        cutoff = timezone.now() - datetime.timedelta(days=settings.RECOMMEND_ACTIVE_DAYS)
+        active = set(User.objects.filter(
+            Q(last_active__gte=cutoff) | Q(last_active__isnull=True), id__in=user_ids
+        ).values_list('id', flat=True))
+        user_ids = active | ({current_user_id} & user_ids)
+    return user_ids
+
+
+def popular_books(user):
+    # fallback ranking for readers outside the model: most liked, shared and rated first. Correlated counts
+    # over the book_id indexes: joining all three relations multiplies their rows before the DISTINCT counts
+    return Book.objects.exclude(likes=user).annotate(
+        popularity=related_count(Book.likes.through) + related_count(Book.shares.through) + related_count(BookRating)
+    ).order_by('-popularity', '-id')
+
+
+def popular_recommendations(request):
+    rows = BookRows(request, absolute_urls=False)
+    return FastJsonResponse({"recommended_books": rows.data(rows.values(popular_books(request.user)))})
+
+
 class UserRegistrationView(CreateAPIView):
     """
     API endpoint that allows users to be registered and email confirmation to be sent.
@@ -93,15 +149,23 @@ class UserView(RetrieveUpdateDestroyAPIView):
         return user
 
 
+@use_read_replica
 @api_view(('GET',))
 def recommend(request):  # user_id
     if not request.user.is_authenticated:
         print(request.user)
         return Response(status=status.HTTP_401_UNAUTHORIZED)
+    training_ids = training_user_ids(request.user.id)
+    if request.user.id not in training_ids or len(training_ids) < 2:
+        # dormant or new reader, or no one to compare with: nothing to base a personal model on
+        return popular_recommendations(request)
+
+    build_started = time.perf_counter()
     data = []
-    all_users = User.objects.all()
+    # matrix rows are the training users only, so the model grows with activity instead of signups
+    user_rows = {user_id: row for row, user_id in enumerate(sorted(training_ids))}
     # Iterate over each user
-    for user in all_users:
+    for user in User.objects.filter(id__in=user_rows).order_by('id'):
         # Annotate each Book object with information about whether the current user liked and/or shared the book
         books_with_user_interaction_info = Book.objects.annotate(
             liked_by_user=Exists(user.likes.filter(id=OuterRef('pk'))),
@@ -130,23 +194,30 @@ def recommend(request):  # user_id
     df['reading_time'] = df["reading_time"].apply(scale_down_to_5, args=(df['reading_time'].max(),))
     df = df.fillna(0)
     print(df)
-    data_matrix = np.zeros((df["user_id"].max(), df["book_id"].max()))
+    data_matrix = np.zeros((len(user_rows), df["book_id"].max()))
 
     for line in df.itertuples():
         print(line)
-        data_matrix[line[1] - 1, line[2] - 1] = line[3] + line[4] + line[5] + line[6]
+        data_matrix[user_rows[line[1]], line[2] - 1] = line[3] + line[4] + line[5] + line[6]
+    if not data_matrix[user_rows[request.user.id]].any():
+        # interactions that add up to nothing (ungraded ratings without reading time): no signal either
+        return popular_recommendations(request)
 
     similarity = pairwise_distances(data_matrix, metric='cosine')
     prediction = predict_ratings(data_matrix, similarity)
+    observe_recommend_build(
+        time.perf_counter() - build_started, ratings=data_matrix, similarity=similarity, prediction=prediction
+    )
     liked_books_ids = set(request.user.likes.values_list('id', flat=True))
-    user_predicted_ratings = prediction[request.user.id - 1]
+    user_predicted_ratings = prediction[user_rows[request.user.id]]
 
-    books = list(Book.objects.all())
+    rows = BookRows(request, absolute_urls=False)
+    books = list(rows.values(Book.objects.all()))
     print(len(books))
     book_ratings = []
     for book in books:
-        if book.id not in liked_books_ids: 
-            rating = user_predicted_ratings[book.id - 1]
+        if book['id'] not in liked_books_ids: 
+            rating = user_predicted_ratings[book['id'] - 1]
             book_ratings.append({'book': book, 'rating': rating})
 
     print(book_ratings)
@@ -155,17 +226,74 @@ def recommend(request):  # user_id
     # Extract sorted books
     sorted_books = [book_rating['book'] for book_rating in book_ratings]
 
-    serializer = BookSerializer(sorted_books, many=True)
-    return JsonResponse({"recommended_books": serializer.data})
+    return FastJsonResponse({"recommended_books": rows.data(sorted_books)})
+
+
+class BookContentSearchView(APIView):
+    """
+    Searches inside the pdf text of books, returning the matching pages with a highlighted snippet.
+    """
+    read_replica = True
+
+    def get(self, request):
+        terms = request.query_params.get('q', '').replace(',', ' ').split()
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), settings.MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'detail': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        hits = search_pages(terms, limit, using=router.db_for_read(Book))
+        titles = dict(Book.objects.filter(id__in={book_id for book_id, _, _ in hits}).values_list('id', 'title'))
+        return Response({"results": [
+            {'book': book_id, 'title': titles[book_id], 'page': page, 'snippet': snippet}
+            for book_id, page, snippet in hits if book_id in titles
+        ]})
+
+
+@require_safe
+def book_file(request, pk):
+    # Streams the pdf with Range/ETag support instead of going through the static media route.
+    # HEAD is allowed too, readers probe the size and Accept-Ranges before fetching ranges
+    book = get_object_or_404(Book.objects.only('id', 'pdfFile'), pk=pk)
+    if not book.pdfFile:
+        raise Http404('Book has no file')
+    return serve_book_file(request, book.pdfFile)
+
+
+@use_read_replica
+@require_GET
+def autocomplete(request):
+    # Plain Django view: no authentication or serializer work on every keystroke
+    query = request.GET.get('q', '')
+    results = book_prefix_index.search(query, settings.AUTOCOMPLETE_MAX_RESULTS)
+    return FastJsonResponse({"results": results})
 
 
 class GenreListCreateView(generics.ListCreateAPIView):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
     permission_classes = [IsSuperUserOrReadOnly]
+    read_replica = True
 
 
-class BookListMyView(generics.ListCreateAPIView):
+class BookRowsListMixin:
+    """
+    GET lists through BookRows instead of the serializer, writes still go through serializer_class.
+    """
+
+    def list(self, request, *args, **kwargs):
+        rows = BookRows(request)
+        queryset = self.filter_queryset(self.get_queryset())
+        # the cursor is read from the ordering columns, selected even when their fields are left out
+        ordering = self.paginator.get_ordering(request, queryset, self) if self.paginator is not None else ()
+        queryset = rows.values(queryset, extra=[field.lstrip('-') for field in ordering])
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(rows.data(page))
+        return Response(rows.data(queryset))
+
+
+class BookListMyView(BookRowsListMixin, generics.ListCreateAPIView):
     serializer_class = BookSerializer
     permission_classes = [IsAuthor]
 
@@ -173,13 +301,16 @@ class BookListMyView(generics.ListCreateAPIView):
         return Book.objects.filter(author=self.request.user.id)
 
 
-class BookListCreateView(generics.ListCreateAPIView):
+class BookListCreateView(BookRowsListMixin, generics.ListCreateAPIView):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    read_replica = True
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, RankedOrderingFilter]
     filterset_fields = ('genre',)
+    # LIKE fallback when the database has no FTS5 index
     search_fields = ('title', 'author__first_name', 'author__last_name')
-    ordering_fields = ('title', 'author__first_name', 'author__last_name')
+    ordering_fields = ('id', 'title', 'author__first_name', 'author__last_name', 'search_rank')
+    ordering = ('-id',)
     permission_classes = [IsAuthenticatedOrReadOnly]
 
     def create(self, request, *args, **kwargs) -> Response:
@@ -201,35 +332,50 @@ class BookListCreateView(generics.ListCreateAPIView):
 
 
 class BookRatingListCreateView(generics.ListCreateAPIView):
-    queryset = BookRating.objects.all()
     serializer_class = BookRatingSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    read_replica = True
+    filter_backends = [OrderingFilter]
+    ordering_fields = ('id', 'grade')
+    ordering = ('-id',)
+
+    def get_queryset(self):
+        # Only the ratings of the book in the url, with just the reviewer name columns joined
+        return BookRating.objects.filter(book_id=self.kwargs.get('pk')).select_related('user').only(
+            'id', 'book_id', 'grade', 'reading_time', 'comment', 'user__id', 'user__first_name', 'user__last_name'
+        )
 
     def perform_create(self, serializer):
-        # Set the current user as the user_id before saving
-        serializer.save(user_id=self.request.user.id, book_id=self.kwargs.get('pk'))
+        # A user has a single rating per book: posting again updates it instead of adding a row
+        reading_time = serializer.validated_data.pop('reading_time', None)
+        rating, created = BookRating.objects.update_or_create(
+            user_id=self.request.user.id, book_id=self.kwargs.get('pk'), defaults=serializer.validated_data
+        )
+        if reading_time:
+            BookRating.objects.filter(pk=rating.pk).update(
+                reading_time=Coalesce(F('reading_time'), Value(datetime.timedelta(0))) + reading_time
+            )
+            rating.refresh_from_db(fields=['reading_time'])
+        serializer.instance = rating
+        return created
 
     def create(self, request, *args, **kwargs) -> Response:
         # Get the current user ID
         if not request.user.is_authenticated:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        # Set the author ID in the request data
-        mutable_data = request.data.copy()
-        # Set the author ID in the mutable data
-        mutable_data = request.data.copy()
         book_id = kwargs.get('pk')
         if not book_id:
             return Response({'detail': 'Book ID not provided'}, status=status.HTTP_400_BAD_REQUEST)
+        if not Book.objects.filter(id=book_id).exists():
+            return Response({'detail': 'Book not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        mutable_data['user_id'] = request.user.id
-        mutable_data['book_id'] = book_id
-
-        # Create the serializer with the modified data
-        serializer = self.get_serializer(data=mutable_data)
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        created = self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK, headers=headers
+        )
 
 
 # GET_PUT_DEL
@@ -244,10 +390,13 @@ class GenreRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class BookRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Book.objects.all()
     serializer_class = BookSingleSerializer
     permission_classes = [IsBookOwnerOrReadOnly]
 
+    def get_queryset(self):
+        # ?fields= / ?omit= also decide the joins, counts and the ratings prefetch
+        return book_detail_queryset(self.request, requested_fields(self.request, self.serializer_class.Meta.fields))
+
     # patch user likes book
 
 
@@ -261,44 +410,48 @@ class BookRatingRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView)
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
 
-        # Get the current reading_time from the instance
-        current_reading_time = instance.reading_time
-
-        # Get the new reading_time from the validated data, defaulting to 0 if not provided
-        additional_reading_time = serializer.validated_data.get('reading_time', datetime.timedelta(seconds=0))
+        # Get the additional reading_time from the validated data, defaulting to 0 if not provided
+        additional_reading_time = serializer.validated_data.pop('reading_time', None) or datetime.timedelta(0)
 
         # Ensure the new reading_time is a timedelta object
         if isinstance(additional_reading_time, int):
             additional_reading_time = datetime.timedelta(seconds=additional_reading_time)
 
-        # Sum the current and new reading_time
-        new_reading_time = current_reading_time + additional_reading_time
-
-        # Update the grade and reading_time
-        instance.grade = serializer.validated_data.get('grade', instance.grade)
-        instance.reading_time = new_reading_time
-        instance.save()
+        # Add the delta in SQL so concurrent updates don't overwrite each other
+        BookRating.objects.filter(pk=instance.pk).update(
+            reading_time=Coalesce(F('reading_time'), Value(datetime.timedelta(0))) + additional_reading_time,
+            **serializer.validated_data
+        )
+        instance.refresh_from_db()
 
-        return Response(serializer.data)
+        return Response(self.get_serializer(instance).data)
 
     def update(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance, data=request.data, partial=True)
-        serializer.is_valid(raise_exception=True)
+        return self.partial_update(request, *args, **kwargs)
 
-        # Add up the reading_time from the request data to the existing reading_time
-        new_reading_time = instance.reading_time + serializer.validated_data.get('reading_time',
-                                                                                 datetime.timedelta(seconds=0))
 
-        # Update the grade and reading_time
-        instance.grade = serializer.validated_data.get('grade', instance.grade)
-        instance.reading_time = new_reading_time
-        instance.save()
+class ReadingHeartbeatView(APIView):
+    """
+    Accepts periodic reading-time heartbeats; they are buffered and flushed in batches.
+    """
+    permission_classes = [IsAuthenticated]
+    stateless_user = True
 
-        return super().update(request, *args, **kwargs)
+    def post(self, request, book_id):
+        serializer = ReadingHeartbeatSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not Book.objects.filter(id=book_id).exists():
+            return Response({'detail': 'Book not found'}, status=status.HTTP_404_NOT_FOUND)
+        reading_time_buffer.add(
+            request.user.id, book_id, datetime.timedelta(seconds=serializer.validated_data['seconds'])
+        )
+        return Response(status=status.HTTP_202_ACCEPTED)
 
 
 class BookLikeView(APIView):
+    # only request.user.id is used, no need to load the user
+    stateless_user = True
+
     def post(self, request, book_id):
         user = request.user
         try:
@@ -316,6 +469,9 @@ class BookLikeView(APIView):
 
 
 class BookShareView(APIView):
+    # only request.user.id is used, no need to load the user
+    stateless_user = True
+
     def post(self, request, book_id):
         user = request.user
         try:
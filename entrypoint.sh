@@ -5,4 +5,9 @@ python manage.py migrate
 
 python manage.py collectstatic --noinput
 #python manage.py runserver 0.0.0.0:8000
-gunicorn backend.wsgi:application --bind 0.0.0.0:8000
+# gunicorn workers share their /metrics samples through this directory, stale files are from the last run
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/bookhub-metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+python manage.py run_worker &
+gunicorn backend.wsgi:application --config backend/gunicorn.conf.py --bind 0.0.0.0:8000